@@ -1,3 +1,6 @@
+import array
+import concurrent.futures
+import contextlib
 import csv
 import datetime
 import glob
@@ -5,16 +8,1404 @@ import hashlib
 import json
 import logging
 import os
+import pickle
 import platform
 import pprint
 import re
 import shutil
+import sqlite3
 import subprocess
 import sys
+import threading
 import time
 import timeit
+import typing
+import uuid
+
+try:
+    import nuke
+except ImportError:
+    # hash benchmark runs in plain python, everything else needs Nuke
+    nuke = None
+
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
+
+# joins TCL strings evaluated in one nuke.tcl call, never used in file paths
+TCL_BATCH_SEPARATOR = '\x1e'
+
+# read buffer for hashing, keeps memory flat no matter the file size
+HASH_CHUNK_SIZE = 4 * 1024 * 1024
+
+# hash algorithms available for file hashes, xxhash only if installed
+HASH_ALGORITHMS = {
+    'blake2b': hashlib.blake2b,
+    'blake2s': hashlib.blake2s,
+    'sha256': hashlib.sha256,
+}
+if xxhash is not None:
+    HASH_ALGORITHMS['xxh3_128'] = xxhash.xxh3_128
+    HASH_ALGORITHMS['xxh64'] = xxhash.xxh64
+
+
+def resolve_hash_algorithm(name) -> str:
+    """
+    Returns name of available hash algorithm.
+    fast is the fastest non-cryptographic hash if available, unknown or missing algorithms fall back to blake2b.
+    """
+    if name == 'fast':
+        name = 'xxh3_128' if 'xxh3_128' in HASH_ALGORITHMS else 'blake2b'
+    if name not in HASH_ALGORITHMS:
+        name = 'blake2b'
+    return name
+
+
+def benchmark_hash_algorithms(size_mb=256, path=None) -> dict:
+    """
+    Measures hashing throughput in MB/s of every available algorithm, on the same random data in memory.
+    With path, the storage read speed of the file is measured separately as 'read',
+    the file is dropped from the page cache first where the system allows it.
+    Hashing files runs at about the lower of the read and the hash speed.
+    """
+    results = {}
+    data = memoryview(os.urandom(HASH_CHUNK_SIZE))
+    for name, constructor in HASH_ALGORITHMS.items():
+        hasher = constructor()
+        processed = 0
+        start = time.perf_counter()
+        while processed < size_mb * 1024 * 1024:
+            hasher.update(data)
+            processed += len(data)
+        hasher.hexdigest()
+        duration = max(time.perf_counter() - start, 1e-9)
+        results[name] = processed / (1024 * 1024) / duration
+
+    if path is not None:
+        buffer = bytearray(HASH_CHUNK_SIZE)
+        processed = 0
+        with open(path, 'rb', buffering=0) as one_file:
+            if hasattr(os, 'posix_fadvise'):
+                # cold read, not the page cache left by an earlier run
+                os.posix_fadvise(one_file.fileno(), 0, 0, os.POSIX_FADV_DONTNEED)
+            start = time.perf_counter()
+            while True:
+                read = one_file.readinto(buffer)
+                if not read:
+                    break
+                processed += read
+        duration = max(time.perf_counter() - start, 1e-9)
+        results['read'] = processed / (1024 * 1024) / duration
+    return results
+
+
+class HashCache:
+    """
+    Persistent file hash cache in SQLite database, shared by all pack jobs.
+    A cached hash is valid only if normalized path, hash algorithm, size, mtime_ns and inode match the file on disk.
+    Hits and new hashes are written in batches, the least recently used entries are evicted on close.
+    """
+
+    # pending writes are flushed once there is this many of them
+    FLUSH_COUNT = 500
+
+    def __init__(self, db_path, algorithm='blake2b', max_entries=1000000, timeout=60.0):
+        self.db_path = db_path
+        self.algorithm = algorithm
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._pending_hashes = []
+        self._pending_touches = []
+        self._lock = threading.Lock()
+
+        db_dir = os.path.dirname(db_path)
+        if db_dir:
+            os.makedirs(db_dir, exist_ok=True)
+        # default rollback journal, WAL needs shared memory that does not work on network shares
+        # busy timeout makes concurrent Deadline tasks wait for the lock instead of failing
+        self._connection = sqlite3.connect(db_path, timeout=timeout, isolation_level=None, check_same_thread=False)
+        self._connection.execute('CREATE TABLE IF NOT EXISTS file_hashes ('
+                                 'path TEXT, algorithm TEXT, size INTEGER, mtime_ns INTEGER, inode INTEGER, '
+                                 'hash TEXT, last_used REAL, PRIMARY KEY (path, algorithm))')
+        self._connection.execute('CREATE INDEX IF NOT EXISTS file_hashes_last_used ON file_hashes (last_used)')
+
+    @staticmethod
+    def normalize_path(path) -> str:
+        return os.path.normcase(os.path.abspath(path)).replace('\\', '/')
+
+    def get(self, path, stat):
+        """
+        Returns cached hash, or None if the file is not cached or has changed
+        """
+        key = self.normalize_path(path)
+        with self._lock:
+            try:
+                row = self._connection.execute(
+                    'SELECT hash FROM file_hashes '
+                    'WHERE path = ? AND algorithm = ? AND size = ? AND mtime_ns = ? AND inode = ?',
+                    (key, self.algorithm, stat.st_size, stat.st_mtime_ns, stat.st_ino)).fetchone()
+            except sqlite3.Error as e:
+                log.warning(f"Hash cache read failed for {path}: {e}")
+                row = None
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._pending_touches.append((time.time(), key, self.algorithm))
+            self._flush_if_needed()
+        return row[0]
+
+    def set(self, path, stat, file_hash):
+        key = self.normalize_path(path)
+        with self._lock:
+            self._pending_hashes.append((key, self.algorithm, stat.st_size, stat.st_mtime_ns, stat.st_ino,
+                                         file_hash, time.time()))
+            self._flush_if_needed()
+
+    def _flush_if_needed(self):
+        if len(self._pending_hashes) + len(self._pending_touches) >= self.FLUSH_COUNT:
+            self._flush()
+
+    def _flush(self):
+        if not self._pending_hashes and not self._pending_touches:
+            return
+        try:
+            self._connection.execute('BEGIN IMMEDIATE')
+            self._connection.executemany('INSERT OR REPLACE INTO file_hashes VALUES (?, ?, ?, ?, ?, ?, ?)',
+                                         self._pending_hashes)
+            self._connection.executemany('UPDATE file_hashes SET last_used = ? WHERE path = ? AND algorithm = ?',
+                                         self._pending_touches)
+            self._connection.execute('COMMIT')
+        except sqlite3.Error as e:
+            log.warning(f"Hash cache write failed: {e}")
+            if self._connection.in_transaction:
+                self._connection.execute('ROLLBACK')
+        self._pending_hashes = []
+        self._pending_touches = []
+
+    def evict(self):
+        """
+        Removes the least recently used entries above max_entries
+        """
+        try:
+            self._connection.execute('BEGIN IMMEDIATE')
+            count = self._connection.execute('SELECT COUNT(*) FROM file_hashes').fetchone()[0]
+            if count > self.max_entries:
+                self._connection.execute(
+                    'DELETE FROM file_hashes WHERE rowid IN '
+                    '(SELECT rowid FROM file_hashes ORDER BY last_used LIMIT ?)',
+                    (count - self.max_entries,))
+            self._connection.execute('COMMIT')
+        except sqlite3.Error as e:
+            log.warning(f"Hash cache eviction failed: {e}")
+            if self._connection.in_transaction:
+                self._connection.execute('ROLLBACK')
+
+    def close(self):
+        with self._lock:
+            self._flush()
+            self.evict()
+            self._connection.close()
+
+
+
+class ObjectStore:
+    """
+    Content addressed store shared by all pack tasks of one package, objects are named by file hash.
+    Every object is claimed with O_EXCL lock file, written under a temporary name and renamed,
+    so parallel tasks write each object once and never link to a partly written one.
+    Lock files hold the id of the task, held locks are touched every quarter of lock_timeout while writing,
+    so only locks of crashed tasks get stale, and a task removes only its own locks.
+    Category paths are hard links to the objects, copies where hard links are not possible.
+    """
+
+    def __init__(self, directory, algorithm, lock_timeout=600.0):
+        self.directory = directory.rstrip('/') + '/' + algorithm
+        self.lock_timeout = lock_timeout
+        # bytes of objects written by this task, bytes of targets made as hard links
+        self.stored = 0
+        self.stored_bytes = 0
+        self.linked = 0
+        self.linked_bytes = 0
+        self.owner = uuid.uuid4().hex
+        # lock files held by this task, refreshed by the heartbeat thread
+        self._held = set()
+        self._heartbeat = None
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        os.makedirs(self.directory + '/tmp', exist_ok=True)
+
+    @property
+    def saved_bytes(self) -> int:
+        return max(0, self.linked_bytes - self.stored_bytes)
+
+    def object_path(self, file_hash) -> str:
+        return f'{self.directory}/{file_hash[:2]}/{file_hash}'
+
+    def temp_path(self) -> str:
+        return f'{self.directory}/tmp/{uuid.uuid4().hex}'
+
+    def claim(self, object_path) -> bool:
+        """Creates the lock file of the object, False if another task holds it"""
+        lock_path = object_path + '.lock'
+        os.makedirs(os.path.dirname(object_path), exist_ok=True)
+        for attempt in range(2):
+            try:
+                lock_file = os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            except FileExistsError:
+                # lock left by a crashed task is taken over
+                try:
+                    if time.time() - os.path.getmtime(lock_path) < self.lock_timeout:
+                        return False
+                    os.remove(lock_path)
+                except OSError:
+                    pass
+                continue
+            try:
+                os.write(lock_file, self.owner.encode())
+            finally:
+                os.close(lock_file)
+            with self._lock:
+                self._held.add(lock_path)
+                if self._heartbeat is None:
+                    self._heartbeat = threading.Thread(target=self._refresh_locks, daemon=True)
+                    self._heartbeat.start()
+            return True
+        return False
+
+    def _owns(self, lock_path) -> bool:
+        try:
+            with open(lock_path, 'rb') as lock_file:
+                return lock_file.read() == self.owner.encode()
+        except OSError:
+            return False
+
+    def _refresh_locks(self):
+        """Touches held lock files, so other tasks do not take over a lock of a long write"""
+        while not self._stop.wait(max(1.0, self.lock_timeout / 4)):
+            with self._lock:
+                held = list(self._held)
+            for lock_path in held:
+                if self._owns(lock_path):
+                    with contextlib.suppress(OSError):
+                        os.utime(lock_path)
+
+    def release(self, object_path):
+        lock_path = object_path + '.lock'
+        with self._lock:
+            self._held.discard(lock_path)
+        # the lock could be taken over, removing it would unlock the new owner
+        if self._owns(lock_path):
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(lock_path)
+
+    def close(self):
+        self._stop.set()
+
+    def wait(self, object_path) -> bool:
+        """Waits for another task writing the object, True if it is there"""
+        deadline = time.time() + self.lock_timeout
+        while os.path.exists(object_path + '.lock') and time.time() < deadline:
+            time.sleep(0.5)
+        return os.path.isfile(object_path)
+
+    def publish(self, temp_path, file_hash, size) -> str:
+        """Moves written temporary file to its object path, same hash is the same content"""
+        object_path = self.object_path(file_hash)
+        os.makedirs(os.path.dirname(object_path), exist_ok=True)
+        os.replace(temp_path, object_path)
+        with self._lock:
+            self.stored += 1
+            self.stored_bytes += size
+        return object_path
+
+    def link(self, object_path, targets, size):
+        for target in targets:
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(target)
+            try:
+                os.link(object_path, target)
+            except OSError:
+                # other volume or no hard links on this file system
+                shutil.copy2(object_path, target)
+                continue
+            with self._lock:
+                self.linked += 1
+                self.linked_bytes += size
+
+
+class DirectoryCache:
+    """
+    Per-run snapshot of directory listings.
+    Every directory is read once with os.scandir, the DirEntry objects keep names, types, sizes and mtimes,
+    so existence, sequence, size and fingerprint questions for many knobs in the same folder
+    do not touch the storage again.
+    Paths found missing are remembered too, anything under a missing path is answered without probing.
+    Directories that can be traversed but not listed (no read permission) are asked path by path with os.path.
+    """
+
+    def __init__(self):
+        # normalized directory -> {normalized name: DirEntry}, None for missing directory
+        self._listings = {}
+        # normalized paths known to be missing
+        self.missing = set()
+        self.missing_hits = 0
+        # normalized directories os.scandir failed on for other reasons than missing
+        self.unlistable = set()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(path) -> str:
+        return os.path.normcase(path.replace('\\', '/'))
+
+    def _split(self, path):
+        path = path.replace('\\', '/')
+        if len(path) > 1:
+            path = path.rstrip('/')
+        directory, name = os.path.split(path)
+        return directory, name
+
+    def listing(self, directory):
+        """
+        Returns {normalized name: DirEntry} of the directory, None if it does not exist or cannot be listed
+        """
+        key = self._key(directory or '.')
+        with self._lock:
+            if key in self._listings:
+                if self._listings[key] is None and key not in self.unlistable:
+                    self.missing_hits += 1
+                return self._listings[key]
+        if self.known_missing(key):
+            listing = None
+        else:
+            try:
+                with os.scandir(directory or '.') as entries:
+                    listing = {self._key(entry.name): entry for entry in entries}
+            except (FileNotFoundError, NotADirectoryError):
+                listing = None
+            except OSError as e:
+                # no permission to list, files in it can still be there
+                log.warning(f"Cannot list {directory}, checking its files one by one: {e}")
+                with self._lock:
+                    self._listings[key] = None
+                    self.unlistable.add(key)
+                return None
+        with self._lock:
+            self._listings[key] = listing
+            if listing is None:
+                self.missing.add(key)
+        return listing
+
+    def _in_unlistable(self, path) -> bool:
+        directory, name = self._split(path)
+        with self._lock:
+            return self._key(directory or '.') in self.unlistable
+
+    def known_missing(self, key) -> bool:
+        """
+        True if the normalized path or any of its parents is known to be missing
+        """
+        with self._lock:
+            while key:
+                if key in self.missing:
+                    self.missing_hits += 1
+                    return True
+                parent = os.path.dirname(key)
+                if parent == key:
+                    break
+                key = parent
+        return False
+
+    def _entry(self, path):
+        directory, name = self._split(path)
+        if name == '':
+            return None
+        key = self._key(directory + '/' + name if directory else name)
+        if self.known_missing(key):
+            return None
+        listing = self.listing(directory)
+        entry = listing.get(self._key(name)) if listing is not None else None
+        if entry is None and not self._in_unlistable(path):
+            with self._lock:
+                self.missing.add(key)
+        return entry
+
+    def exists(self, path) -> bool:
+        directory, name = self._split(path)
+        if name == '':
+            # filesystem root or drive
+            return os.path.exists(path)
+        entry = self._entry(path)
+        if entry is None and self._in_unlistable(path):
+            return os.path.exists(path)
+        return entry is not None
+
+    def isdir(self, path) -> bool:
+        directory, name = self._split(path)
+        if name == '':
+            return os.path.isdir(path)
+        entry = self._entry(path)
+        if entry is None and self._in_unlistable(path):
+            return os.path.isdir(path)
+        return entry is not None and entry.is_dir()
+
+    def isfile(self, path) -> bool:
+        entry = self._entry(path)
+        if entry is None and self._in_unlistable(path):
+            return os.path.isfile(path)
+        return entry is not None and entry.is_file()
+
+    def getsize(self, path) -> int:
+        entry = self._entry(path)
+        if entry is None:
+            return os.path.getsize(path)
+        return entry.stat().st_size
+
+    def stat(self, path):
+        """
+        Stat result kept by the DirEntry if the directory was already scanned,
+        os.stat for paths outside the scanned directories.
+        On POSIX DirEntry.stat() is still one stat call per file, cached after the first one,
+        the scan only saves the repeated calls of the hash cache, fingerprints and copy.
+        On Windows DirEntry.stat() comes from the listing without a call, but with st_ino 0, see cache_stat().
+        """
+        directory, name = self._split(path)
+        with self._lock:
+            listing = self._listings.get(self._key(directory or '.'))
+        entry = listing.get(self._key(name)) if listing and name else None
+        if entry is None:
+            return os.stat(path)
+        return entry.stat()
+
+    def cache_stat(self, path):
+        """
+        Stat for hash cache keys, they need st_ino, DirEntry.stat() has 0 there on Windows, os.stat is used.
+        """
+        if os.name == 'nt':
+            return os.stat(path)
+        return self.stat(path)
+
+    def walk_files(self, directory) -> list:
+        """
+        All files under directory, same order as glob.glob(directory + '/**', recursive=True)
+        """
+        files = []
+        listing = self.listing(directory)
+        if listing is None:
+            return files
+        for entry in listing.values():
+            if entry.name.startswith('.'):
+                continue
+            path = directory.rstrip('/') + '/' + entry.name
+            if entry.is_file():
+                files.append(path)
+            elif entry.is_dir():
+                files += self.walk_files(path)
+        return files
+
+
+class FileSequence:
+    """
+    Compact file sequence: directory, prefix, frame padding, suffix and frame numbers.
+    Per file sizes are kept in array('Q') and hashes in one packed bytes buffer,
+    so memory scales with the number of sequences, not with the number of frames.
+    Single file is a sequence of one file with no padding.
+    """
+
+    # hash tier codes stored per file
+    TIERS = ('', 'full', 'fast', 'stat')
+
+    def __init__(self, directory, prefix, padding=0, suffix=''):
+        self.directory = directory
+        self.prefix = prefix
+        self.padding = padding
+        self.suffix = suffix
+        # frames in directory listing order, the same order glob used to return them
+        self.frames = array.array('q')
+        self.sizes = array.array('Q')
+        self.digest_size = 0
+        self.digests = bytearray()
+        self.tiers = bytearray()
+        # some frames found on the storage were left out by trim()
+        self.trimmed = False
+
+    @classmethod
+    def from_file(cls, path, size):
+        directory, name = os.path.split(path)
+        sequence = cls(directory, name)
+        sequence.append(0, size)
+        return sequence
+
+    @classmethod
+    def from_listing(cls, directory, prefix, padding, suffix, dir_cache):
+        """
+        Finds all frames of prefix + frame number + suffix in the cached directory listing
+        """
+        sequence = cls(directory, prefix, padding, suffix)
+        listing = dir_cache.listing(directory)
+        if listing is None:
+            return sequence
+        key_prefix = os.path.normcase(prefix)
+        key_suffix = os.path.normcase(suffix)
+        length = len(prefix) + padding + len(suffix)
+        for key, entry in listing.items():
+            if len(key) != length or not key.startswith(key_prefix) or not key.endswith(key_suffix):
+                continue
+            if key.startswith('.') and not key_prefix.startswith('.'):
+                # same as glob, hidden files need explicit dot
+                continue
+            frame_text = entry.name[len(prefix):len(prefix) + padding]
+            try:
+                frame = int(frame_text)
+            except ValueError:
+                continue
+            if sequence.frame_text(frame) != frame_text or not entry.is_file():
+                continue
+            sequence.append(frame, entry.stat().st_size)
+        return sequence
+
+    def __repr__(self):
+        return f"FileSequence('{self.directory}/{self.glob_filter()}', {len(self)} files)"
+
+    def append(self, frame, size):
+        self.frames.append(frame)
+        self.sizes.append(size)
+
+    def __len__(self):
+        return len(self.frames)
+
+    def trim(self, first, last):
+        """Keeps only frames from first to last, must be done before hashing"""
+        if not self.padding:
+            return
+        keep = [i for i, frame in enumerate(self.frames) if first <= frame <= last]
+        if len(keep) == len(self.frames):
+            return
+        self.frames = array.array('q', (self.frames[i] for i in keep))
+        self.sizes = array.array('Q', (self.sizes[i] for i in keep))
+        self.trimmed = True
+
+    def frame_text(self, frame) -> str:
+        if not self.padding:
+            return ''
+        return f'{frame:0{self.padding}d}'
+
+    def name(self, i) -> str:
+        return self.prefix + self.frame_text(self.frames[i]) + self.suffix
+
+    def path(self, i) -> str:
+        if self.directory:
+            return self.directory + '/' + self.name(i)
+        return self.name(i)
 
-import nuke
+    def glob_filter(self) -> str:
+        """foo.????.exr for sequence, file name for single file"""
+        return self.prefix + '?' * self.padding + self.suffix
+
+    def get_hash(self, i):
+        if not self.digest_size or not self.tiers[i]:
+            return None
+        return self.digests[i * self.digest_size:(i + 1) * self.digest_size].hex()
+
+    def get_digest(self, i):
+        """Raw digest bytes, view of the packed buffer, None if not hashed"""
+        if not self.digest_size or not self.tiers[i]:
+            return None
+        return memoryview(self.digests)[i * self.digest_size:(i + 1) * self.digest_size]
+
+    def get_tier(self, i) -> str:
+        if not self.tiers:
+            return ''
+        return self.TIERS[self.tiers[i]]
+
+    def set_hash(self, i, file_hash, tier):
+        digest = bytes.fromhex(file_hash)
+        if not self.digest_size:
+            self.digest_size = len(digest)
+            self.digests = bytearray(self.digest_size * len(self))
+            self.tiers = bytearray(len(self))
+        elif len(digest) != self.digest_size:
+            raise ValueError(f"Hash of {self.path(i)} has {len(digest)} bytes, sequence uses {self.digest_size}.")
+        self.digests[i * self.digest_size:(i + 1) * self.digest_size] = digest
+        self.tiers[i] = self.TIERS.index(tier)
+
+    def identity(self) -> tuple:
+        return self.directory, self.prefix, self.padding, self.suffix, self.frames.tobytes(), self.sizes.tobytes()
+
+    def pattern(self) -> tuple:
+        """Same for every frame subset of one sequence"""
+        return self.directory, self.prefix, self.padding, self.suffix
+
+    def merge(self, other):
+        """Adds frames of other subset of the same sequence, must be done before hashing"""
+        frames = set(self.frames)
+        for frame, size in zip(other.frames, other.sizes):
+            if frame not in frames:
+                frames.add(frame)
+                self.append(frame, size)
+        # union of two trimmed subsets can still miss frames
+        self.trimmed = self.trimmed and other.trimmed
+
+
+class FileSet:
+    """
+    All files of one media item, one FileSequence per stereo view.
+    Files are indexed in the order of the sequences.
+    """
+
+    def __init__(self, sequences=None):
+        self.sequences = []
+        for sequence in sequences or []:
+            self.append(sequence)
+
+    def __repr__(self):
+        return f"FileSet({self.sequences})"
+
+    def append(self, sequence):
+        if len(sequence):
+            self.sequences.append(sequence)
+
+    def __len__(self):
+        return sum(len(sequence) for sequence in self.sequences)
+
+    def trim(self, first, last):
+        """Keeps only frames from first to last in every sequence, drops sequences left empty"""
+        for sequence in self.sequences:
+            sequence.trim(first, last)
+        self.sequences = [sequence for sequence in self.sequences if len(sequence)]
+
+    def __eq__(self, other):
+        return isinstance(other, FileSet) and self.identity() == other.identity()
+
+    def identity(self) -> tuple:
+        return tuple(sequence.identity() for sequence in self.sequences)
+
+    def pattern(self) -> tuple:
+        """Sequence patterns of all views, None if any view is a single file"""
+        if not self.sequences or not all(sequence.padding for sequence in self.sequences):
+            return None
+        return tuple(sequence.pattern() for sequence in self.sequences)
+
+    def merge(self, other):
+        """Adds frames of other file set with the same pattern, view by view"""
+        for sequence, other_sequence in zip(self.sequences, other.sequences):
+            sequence.merge(other_sequence)
+
+    @property
+    def total_size(self) -> int:
+        return sum(sum(sequence.sizes) for sequence in self.sequences)
+
+    def _locate(self, i):
+        for sequence in self.sequences:
+            if i < len(sequence):
+                return sequence, i
+            i -= len(sequence)
+        raise IndexError('FileSet index out of range')
+
+    def path(self, i) -> str:
+        sequence, i = self._locate(i)
+        return sequence.path(i)
+
+    def name(self, i) -> str:
+        sequence, i = self._locate(i)
+        return sequence.name(i)
+
+    def get_hash(self, i):
+        sequence, i = self._locate(i)
+        return sequence.get_hash(i)
+
+    def get_tier(self, i) -> str:
+        sequence, i = self._locate(i)
+        return sequence.get_tier(i)
+
+    def set_hash(self, i, file_hash, tier):
+        sequence, i = self._locate(i)
+        sequence.set_hash(i, file_hash, tier)
+
+    def paths(self):
+        for sequence in self.sequences:
+            for i in range(len(sequence)):
+                yield sequence.path(i)
+
+    def names(self):
+        for sequence in self.sequences:
+            for i in range(len(sequence)):
+                yield sequence.name(i)
+
+    def hashes(self):
+        for sequence in self.sequences:
+            for i in range(len(sequence)):
+                yield sequence.get_hash(i)
+
+    def tiers(self):
+        for sequence in self.sequences:
+            for i in range(len(sequence)):
+                yield sequence.get_tier(i)
+
+    def leaves(self):
+        """
+        (view, frame, sequence, index) of every file, sorted by view and frame.
+        Order of merkle tree leaves, it does not depend on the file system listing order.
+        """
+        for view, sequence in enumerate(self.sequences):
+            for i in sorted(range(len(sequence)), key=sequence.frames.__getitem__):
+                yield view, sequence.frames[i], sequence, i
+
+    def leaf_digests(self):
+        """Raw digests in leaf order, read straight from the packed buffers"""
+        for view, frame, sequence, i in self.leaves():
+            yield sequence.get_digest(i)
+
+
+def merkle_levels(digests):
+    """
+    Yields levels of the merkle tree of raw file digests as lists of raw node digests, from the leaves to the root.
+    Leaves and interior nodes are hashed with different prefix, odd last node is promoted to the next level.
+    """
+    level = [hashlib.blake2b(b'\x00' + digest).digest() for digest in digests]
+    if not level:
+        return
+    yield level
+    while len(level) > 1:
+        next_level = [hashlib.blake2b(b'\x01' + level[i] + level[i + 1]).digest()
+                      for i in range(0, len(level) - 1, 2)]
+        if len(level) % 2:
+            next_level.append(level[-1])
+        yield next_level
+        level = next_level
+
+
+def merkle_tree(digests) -> list:
+    """
+    Merkle tree of raw file digests as hex levels, only built for the manifest.
+    """
+    return [[node.hex() for node in level] for level in merkle_levels(digests)]
+
+
+def merkle_root(digests) -> str:
+    """
+    Hex root of the merkle tree, only one level is kept in memory at a time.
+    """
+    root = ''
+    for level in merkle_levels(digests):
+        root = level[0].hex() if len(level) == 1 else ''
+    return root
+
+
+def merkle_diff(tree_a, tree_b) -> list:
+    """
+    Indexes of leaves (files) that differ between two merkle trees.
+    Leaves are sorted by view and frame, see manifest 'frames' for the frame of each index.
+    Walks down only from the differing nodes, so the cost is O(changed files * log n).
+    Trees with different number of leaves have different shape, then all leaves are compared.
+    """
+    if not tree_a or not tree_b or len(tree_a[0]) != len(tree_b[0]):
+        leaves_a = tree_a[0] if tree_a else []
+        leaves_b = tree_b[0] if tree_b else []
+        changed = [i for i, (a, b) in enumerate(zip(leaves_a, leaves_b)) if a != b]
+        return changed + list(range(min(len(leaves_a), len(leaves_b)), max(len(leaves_a), len(leaves_b))))
+
+    changed = [0] if tree_a[-1] != tree_b[-1] else []
+    for depth in range(len(tree_a) - 1, 0, -1):
+        children_a = tree_a[depth - 1]
+        children_b = tree_b[depth - 1]
+        next_changed = []
+        for i in changed:
+            for child in (2 * i, 2 * i + 1):
+                if child < len(children_a) and children_a[child] != children_b[child]:
+                    next_changed.append(child)
+        changed = next_changed
+    return changed
+
+
+# knobs holding file paths by knob name, .nk files do not store knob classes
+NK_FILE_KNOBS = ('file', 'proxy', 'vfield_file')
+
+# knobs discovery reads as plain values, expressions and animations in them need Nuke
+NK_VALUE_KNOBS = ('disable', 'first', 'last', 'frame', 'use_limit', 'inputs', 'number')
+NK_ROOT_VALUE_KNOBS = ('first_frame', 'last_frame')
+
+# node classes with no input unless 'inputs' is saved, all other nodes take one
+NK_SOURCE_CLASSES = (
+    'Read', 'ReadGeo', 'ReadGeo2', 'DeepRead', 'Constant', 'CheckerBoard2', 'ColorBars', 'ColorWheel',
+    'Input', 'BackdropNode', 'StickyNote', 'Camera', 'Camera2', 'Camera3', 'Axis', 'Axis2', 'Axis3',
+    'Light', 'Light2', 'Light3', 'Spotlight', 'DirectLight', 'Environment', 'Precomp'
+)
+
+# compiled node classes of Nuke, any other class of a headless read script is a gizmo or a plugin,
+# unless its .gizmo, .so, .dll or .dylib file is found on the plugin path, the script is opened in Nuke
+NK_BUILTIN_CLASSES = frozenset((
+    'Root', 'Group', 'LiveGroup', 'Input', 'Output', 'Viewer', 'BackdropNode', 'StickyNote', 'Dot', 'NoOp',
+    'Precomp', 'PostageStamp', 'Read', 'Write', 'DeepRead', 'DeepWrite', 'ReadGeo', 'ReadGeo2', 'WriteGeo',
+    'Constant', 'CheckerBoard2', 'ColorBars', 'ColorWheel', 'Ramp', 'Radial', 'Rectangle', 'Noise', 'Text2',
+    'Roto', 'RotoPaint', 'SplineWarp3', 'GridWarp3', 'Merge2', 'Keymix', 'Copy', 'ChannelMerge', 'AddMix',
+    'Dissolve', 'Switch', 'Shuffle', 'Shuffle2', 'ShuffleCopy', 'Remove', 'AddChannels', 'Grade', 'ColorCorrect',
+    'HueCorrect', 'HueShift', 'Saturation', 'ColorLookup', 'ColorMatrix', 'Multiply', 'Add', 'Gamma', 'Clamp',
+    'Invert', 'Exposure', 'Histogram', 'Colorspace', 'OCIOColorSpace', 'OCIODisplay', 'OCIOFileTransform',
+    'OCIOCDLTransform', 'OCIOLookTransform', 'OCIOLogConvert', 'Vectorfield', 'Log2Lin', 'Premult', 'Unpremult',
+    'Expression', 'MergeExpression', 'Blur', 'Defocus', 'ZDefocus2', 'Bokeh', 'Convolve2', 'Sharpen', 'Soften',
+    'EdgeBlur', 'Glow2', 'Erode', 'FilterErode', 'Dilate', 'Median', 'Denoise2', 'Grain2', 'ScannedGrain',
+    'LensDistortion2', 'STMap', 'IDistort', 'Transform', 'TransformMasked', 'Reformat', 'Crop', 'Mirror2',
+    'Position', 'CornerPin2D', 'Tracker4', 'Card3D', 'Camera', 'Camera2', 'Camera3', 'Camera4', 'Axis', 'Axis2',
+    'Axis3', 'Axis4', 'Light', 'Light2', 'Light3', 'Light4', 'Spotlight', 'DirectLight', 'Environment',
+    'Scene', 'ScanlineRender', 'ScanlineRender2', 'RayRender', 'Card2', 'Cube', 'Cylinder', 'Sphere',
+    'TransformGeo', 'MergeGeo', 'ApplyMaterial', 'Project3D2', 'Phong', 'BasicMaterial', 'Emission',
+    'FrameHold', 'FrameRange', 'TimeOffset', 'Retime', 'OFlow2', 'Kronos', 'TimeWarp', 'TimeBlur',
+    'AppendClip', 'FrameBlend', 'Keyer', 'Primatte3', 'Keylight', 'IBKColourV3', 'HueKeyer', 'Difference',
+    'ChromaKeyer', 'Cryptomatte', 'MotionBlur', 'MotionBlur2D', 'VectorBlur2', 'VectorGenerator', 'SmartVector',
+    'DeepMerge', 'DeepRecolor', 'DeepToImage', 'DeepExpression', 'DeepHoldout2', 'DeepTransform', 'DeepColorCorrect2',
+    'DeepCrop', 'DeepReformat', 'PositionToPoints2', 'ZBlur', 'Blend', 'Matrix', 'Tile', 'Flip', 'Mirror',
+    'CopyBBox', 'AdjBBox', 'BlackOutside', 'Inpaint2', 'LightWrap', 'ParticleEmitter',
+    'BlinkScript', 'CopyRectangle', 'ModifyMetaData', 'CopyMetaData', 'ViewMetaData', 'CompareMetaData',
+    'JoinViews', 'OneView', 'SplitAndJoin', 'ShuffleViews', 'Anaglyph', 'MixViews', 'SideBySide',
+    'CurveTool', 'PlanarTracker', 'CameraTracker', 'PointCloudGenerator', 'DepthGenerator',
+    'Text', 'TimeClip', 'AddTimeCode', 'ContactSheet', 'LayerContactSheet', 'TimeEcho', 'TimeDissolve',
+    'NoTimeBlur', 'Merge', 'ZMerge', 'MergeMat', 'Tracker3', 'Grid', 'Toe2', 'SoftClip', 'Posterize',
+    'HSVTool', 'MinColor', 'Sampler', 'Reconcile3D', 'Laplacian', 'Emboss', 'Glint',
+))
+
+# project directory expressions that only mean the folder of the script
+NK_SCRIPT_DIRECTORY_EXPRESSIONS = (
+    '[python {nuke.script_directory()}]',
+    '[python nuke.script_directory()]',
+    '[file dirname [value root.name]]',
+    '[file dirname [knob root.name]]'
+)
+
+NK_TOKEN = re.compile(r'[ \t\r]+|\n|"(?:[^"\\]|\\.)*"|[{}]|[^\s{}"]+', re.DOTALL)
+NK_BRACE = re.compile(r'\\.|[{}]', re.DOTALL)
+NK_ESCAPE = re.compile(r'\\(.)', re.DOTALL)
+NK_ESCAPES = {'n': '\n', 't': '\t', 'r': '\r'}
+
+# line markers of .nk blocks
+NK_OPEN = object()
+NK_CLOSE = object()
+
+
+def needs_tcl(text) -> bool:
+    """True if TCL evaluation could change the text: commands, variables, escapes or quotes"""
+    return any(char in text for char in '[$\\"')
+
+
+def tcl_brackets_balanced(text) -> bool:
+    """
+    True if every [ and { of the text is closed in order, escaped characters do not count.
+    Unbalanced text could swallow the separator of eval_tcl_batch() and its neighbours.
+    """
+    stack = []
+    escaped = False
+    for char in text:
+        if escaped:
+            escaped = False
+        elif char == '\\':
+            escaped = True
+        elif char in '[{':
+            stack.append(char)
+        elif char in ']}':
+            if not stack or stack.pop() != ('[' if char == ']' else '{'):
+                return False
+    return not stack
+
+
+class NkKnob:
+    """
+    Knob read from .nk file, mimics the Nuke knob methods discovery uses.
+    """
+
+    def __init__(self, name, text, knob_class='String_Knob'):
+        self.name = name
+        self.text = text
+        self.knob_class = knob_class
+
+    def __repr__(self):
+        return f"NkKnob({self.name}: {self.text})"
+
+    def Class(self) -> str:
+        return self.knob_class
+
+    def toScript(self) -> str:
+        return self.text
+
+    def value(self):
+        if self.text in ('true', 'false'):
+            return self.text == 'true'
+        for convert in (int, float):
+            try:
+                return convert(self.text)
+            except ValueError:
+                pass
+        return self.text
+
+    def getValue(self):
+        if self.knob_class == 'File_Knob':
+            return self.text
+        return self.value()
+
+    def evaluate(self) -> str:
+        # text with TCL in file knobs sends the script to Nuke, see NkScript
+        return self.text
+
+
+class NkNode:
+    """
+    Node read from .nk file, mimics the Nuke node methods discovery uses.
+    Only knobs saved in the script exist, knobs left at default are missing.
+    """
+
+    def __init__(self, node_class, knobs, parent=None):
+        self.node_class = node_class
+        self._knobs = knobs
+        self.parent = parent
+        self.connected = []
+        # set by NkScript.mark_gizmos()
+        self.gizmo = False
+        name = knobs['name'].text if 'name' in knobs else node_class
+        self.full_name = parent.full_name + '.' + name if parent is not None else name
+
+    def __repr__(self):
+        return f"NkNode({self.node_class}: {self.full_name})"
+
+    def Class(self) -> str:
+        return self.node_class
+
+    def fullName(self) -> str:
+        return self.full_name
+
+    def knobs(self) -> dict:
+        return self._knobs
+
+    def knob(self, name):
+        return self._knobs.get(name)
+
+    def __getitem__(self, name):
+        return self._knobs[name]
+
+    def inputs(self) -> int:
+        return len(self.connected)
+
+    def input(self, i):
+        return self.connected[i] if i < len(self.connected) else None
+
+
+class NkScript:
+    """
+    Headless .nk reader, runs in plain Python with no Nuke license.
+    Follows Group nesting and the set/push node stack, so node connections match Nuke.
+    Anything that needs Nuke (TCL in paths, font families, clones) is collected in fallback_reasons,
+    the script is then opened in Nuke instead.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.root = NkNode('Root', {})
+        self.nodes = []
+        self.fallback_reasons = []
+        self._text = ''
+        self._pos = 0
+
+    @classmethod
+    def parse(cls, path):
+        script = cls(path)
+        try:
+            with open(path, 'r', encoding='utf-8', errors='replace') as file:
+                script._text = file.read()
+            script._parse()
+        except (OSError, IndexError, KeyError, ValueError) as e:
+            script.fallback_reasons.append(f"cannot read {path}: {e!r}")
+        script._text = ''
+        return script
+
+    @property
+    def project_directory(self) -> str:
+        """Root project directory, expressions meaning the script folder are resolved"""
+        knob = self.root.knob('project_directory')
+        project_directory = knob.text if knob is not None else ''
+        if project_directory in NK_SCRIPT_DIRECTORY_EXPRESSIONS:
+            project_directory = os.path.dirname(self.path).replace('\\', '/')
+        return project_directory
+
+    def mark_gizmos(self, plugin_path, isfile, known_classes=()):
+        """
+        Nodes are gizmos if their class has .gizmo file on the plugin path.
+        Classes neither builtin, known nor found as gizmo or compiled plugin can come from a folder
+        added by init.py, only Nuke knows, they go to fallback_reasons.
+        """
+        gizmo_classes = {}
+        for node in self.nodes:
+            node_class = node.Class()
+            if node_class not in gizmo_classes:
+                gizmo_name = node_class if node_class.endswith('.gizmo') else node_class + '.gizmo'
+                gizmo_classes[node_class] = any(isfile(os.path.join(one_path, gizmo_name)) for one_path in plugin_path)
+                if (not gizmo_classes[node_class] and node_class not in NK_BUILTIN_CLASSES
+                        and node_class not in known_classes and not node_class.startswith('OFX')
+                        and not any(isfile(os.path.join(one_path, node_class + extension))
+                                    for one_path in plugin_path for extension in ('.so', '.dll', '.dylib'))):
+                    self.fallback_reasons.append(f"{node.fullName()} class {node_class} not found on plugin path")
+            node.gizmo = gizmo_classes[node_class]
+
+    def _braced(self):
+        depth = 1
+        for brace in NK_BRACE.finditer(self._text, self._pos):
+            if brace.group() == '{':
+                depth += 1
+            elif brace.group() == '}':
+                depth -= 1
+                if depth == 0:
+                    word = self._text[self._pos:brace.start()]
+                    self._pos = brace.end()
+                    return word
+        raise ValueError('unbalanced braces')
+
+    def _line(self, allow_open=False):
+        """
+        Words of the next line, braced and quoted words unwrapped, None at the end of the script.
+        Brace ending the line opens a node block where allowed, lone closing brace ends it.
+        """
+        text = self._text
+        words = []
+        while True:
+            match = NK_TOKEN.match(text, self._pos)
+            if match is None:
+                return words or None
+            token = match.group()
+            self._pos = match.end()
+            if token[0] in ' \t\r':
+                continue
+            if token == '\n':
+                if words:
+                    return words
+            elif token == '{':
+                line_end = text.find('\n', self._pos)
+                if allow_open and not text[self._pos:line_end if line_end >= 0 else None].strip():
+                    words.append(NK_OPEN)
+                else:
+                    words.append(self._braced())
+            elif token == '}':
+                words.append(NK_CLOSE)
+            elif token[0] == '"':
+                words.append(NK_ESCAPE.sub(lambda m: NK_ESCAPES.get(m.group(1), m.group(1)), token[1:-1]))
+            else:
+                words.append(token)
+
+    def _knobs(self, node_class):
+        """Knobs of one node block, up to its closing brace"""
+        knobs = {}
+        user_file_knobs = set()
+        while True:
+            words = self._line()
+            if words is None:
+                raise ValueError(f'{node_class} block not closed')
+            closed = words[-1] is NK_CLOSE
+            words = [word for word in words if word is not NK_CLOSE]
+            if words:
+                if words[0] == 'addUserKnob':
+                    # {2 name label...}, type 2 is File_Knob
+                    user_knob = words[1].split() if len(words) > 1 else []
+                    if len(user_knob) > 1 and user_knob[0] == '2':
+                        user_file_knobs.add(user_knob[1])
+                else:
+                    knobs[words[0]] = NkKnob(words[0], ' '.join(words[1:]))
+            if closed:
+                break
+
+        for name, knob in knobs.items():
+            if name == 'font' and node_class == 'Text2':
+                knob.knob_class = 'FreeType_Knob'
+            elif name in NK_FILE_KNOBS or name in user_file_knobs or (name == 'font' and node_class == 'Text'):
+                knob.knob_class = 'File_Knob'
+        return knobs
+
+    def _connect(self, node, stack, default_inputs):
+        """Pops node inputs from the stack, input 0 is on top"""
+        inputs = node.knob('inputs')
+        if inputs is not None:
+            # 2+1 means two inputs and a mask
+            count = sum(int(one) for one in inputs.text.split('+'))
+        else:
+            count = default_inputs
+        node.connected = [stack.pop() if stack else None for _ in range(count)]
+
+    def _parse(self):
+        stack = []
+        named = {}
+        # open groups: [group node, stack outside the group, number of Input nodes]
+        groups = []
+        parent = None
+        while True:
+            words = self._line(allow_open=True)
+            if words is None:
+                break
+            command = words[0]
+            if len(words) == 2 and words[1] is NK_OPEN:
+                knobs = self._knobs(command)
+                if command == 'Root':
+                    self.root = NkNode('Root', knobs)
+                    continue
+                node = NkNode(command, knobs, parent)
+                self.nodes.append(node)
+                for knob in knobs.values():
+                    if knob.Class() == 'File_Knob' and needs_tcl(knob.text):
+                        self.fallback_reasons.append(f"{node.fullName()}.{knob.name} needs TCL: {knob.text}")
+                    elif knob.Class() == 'FreeType_Knob':
+                        self.fallback_reasons.append(f"{node.fullName()}.{knob.name} font family needs Nuke")
+                    elif knob.name in NK_VALUE_KNOBS and self._is_expression(knob.text):
+                        self.fallback_reasons.append(f"{node.fullName()}.{knob.name} needs expression: {knob.text}")
+                if command == 'Input' and groups:
+                    groups[-1][2] += 1
+                if command == 'Group':
+                    # inputs of a group are known after its Input nodes are read
+                    groups.append([node, stack, 0])
+                    stack = []
+                    parent = node
+                else:
+                    self._connect(node, stack, 0 if command in NK_SOURCE_CLASSES else 1)
+                    stack.append(node)
+            elif command == 'end_group':
+                if not groups:
+                    raise ValueError('end_group outside of a group')
+                node, stack, input_count = groups.pop()
+                parent = node.parent
+                self._connect(node, stack, input_count)
+                stack.append(node)
+            elif command == 'set':
+                named[words[1]] = stack[-1] if stack else None
+            elif command == 'push':
+                stack.append(None if words[1] == '0' else named[words[1].lstrip('$')])
+            elif command == 'clone':
+                self.fallback_reasons.append('cloned nodes need Nuke')
+                return
+            # version, define_window_layout_xml, add_layer, cut_paste_input and others are skipped
+
+        if groups:
+            raise ValueError('end_group missing')
+        if needs_tcl(self.project_directory):
+            self.fallback_reasons.append(f"root.project_directory needs TCL: {self.project_directory}")
+        ocio_path = self.root.knob('customOCIOConfigPath')
+        if ocio_path is not None and needs_tcl(ocio_path.text):
+            self.fallback_reasons.append(f"root.customOCIOConfigPath needs TCL: {ocio_path.text}")
+        for name in NK_ROOT_VALUE_KNOBS:
+            knob = self.root.knob(name)
+            if knob is not None and self._is_expression(knob.text):
+                self.fallback_reasons.append(f"root.{name} needs expression: {knob.text}")
+
+    @staticmethod
+    def _is_expression(text) -> bool:
+        """Braced value is an expression or animation, {{parent.disable}} is saved as {parent.disable}"""
+        return text.startswith('{') or needs_tcl(text)
+
+
+class RootContext(typing.NamedTuple):
+    """
+    Immutable snapshot of the Nuke root settings that discovery needs.
+    Taken once after the script is opened, so the knob loop does not query the root node for every knob.
+    """
+    project_directory: str
+    project_directory_raw: str
+    views: tuple
+    float_lut: str
+    int8_lut: str
+    color_management: str
+    ocio_config: str
+    custom_ocio_config_path: str
+    plugin_path: tuple
+    first_frame: int
+    last_frame: int
+
+    @classmethod
+    def from_nuke(cls):
+        root = nuke.root()
+        views = []
+        for rtn in root.knob('views').toScript().split('\n'):
+            # each line is 'name #color', view name is the second to last word
+            if rtn.strip():
+                views.append(rtn.split(' ')[-2])
+        return cls(
+            project_directory=root['project_directory'].evaluate() or '',
+            project_directory_raw=root['project_directory'].getValue() or '',
+            views=tuple(views),
+            float_lut=root['floatLut'].value(),
+            int8_lut=root['int8Lut'].value(),
+            color_management=root.knob('colorManagement').value(),
+            ocio_config=root.knob('OCIO_config').value(),
+            custom_ocio_config_path=root.knob('customOCIOConfigPath').evaluate() or '',
+            plugin_path=tuple(nuke.pluginPath()),
+            first_frame=int(root['first_frame'].value()),
+            last_frame=int(root['last_frame'].value())
+        )
+
+    @classmethod
+    def from_nk(cls, nk_script):
+        """
+        Root settings of headless read script, knobs not saved in the script get Nuke defaults.
+        Plugin path is NUKE_PATH and ~/.nuke, folders added by init.py are not known without Nuke.
+        """
+        root = nk_script.root
+
+        def text(name, default=''):
+            knob = root.knob(name)
+            return knob.text if knob is not None else default
+
+        views_text = text('views', 'main #ffffff')
+        if views_text.startswith('{'):
+            # {{left #ff0000} {right #00ff00}}
+            views = re.findall(r'\{\s*([^\s{}]+)', views_text)
+        else:
+            views = [rtn.split(' ')[-2] for rtn in views_text.split('\n') if rtn.strip()]
+        plugin_path = [one for one in os.environ.get('NUKE_PATH', '').split(os.pathsep) if one]
+        plugin_path.append(os.path.join(os.path.expanduser('~'), '.nuke'))
+        return cls(
+            project_directory=nk_script.project_directory,
+            project_directory_raw=text('project_directory'),
+            views=tuple(views),
+            float_lut=text('floatLut', 'linear'),
+            int8_lut=text('int8Lut', 'sRGB'),
+            color_management=text('colorManagement', 'Nuke'),
+            ocio_config=text('OCIO_config', 'nuke-default'),
+            custom_ocio_config_path=text('customOCIOConfigPath'),
+            plugin_path=tuple(one.replace('\\', '/') for one in plugin_path),
+            first_frame=int(text('first_frame', '1')),
+            last_frame=int(text('last_frame', '100'))
+        )
+
+
+class NodeGraph:
+    """
+    Inputs and outputs of all nodes in the script, built once from node.input().
+    Nodes are keyed by full name, so nodes replaced later (gizmos to groups) can be swapped in.
+    Only pipe connections are indexed, expression links are not.
+    """
+
+    def __init__(self, nodes):
+        # full name: node
+        self.nodes = {}
+        # full name: node class
+        self.classes = {}
+        # full names of disabled nodes
+        self.disabled = set()
+        # full name: list of input full names by input index, None for empty inputs
+        self.inputs = {}
+        # full name: list of (dependent full name, input index)
+        self.outputs = {}
+        # group full name: full name of its Output node
+        self.group_outputs = {}
+        # Output node full name: group full name
+        self.output_groups = {}
+        # Input node full name: (group full name, group input index)
+        self.group_inputs = {}
+        # (group full name, group input index): Input node full name
+        self.group_input_nodes = {}
+        for node in nodes:
+            name = node.fullName()
+            node_class = node.Class()
+            self.nodes[name] = node
+            self.classes[name] = node_class
+            self.inputs[name] = []
+            self.outputs.setdefault(name, [])
+            if node.knob('disable') and node['disable'].getValue():
+                self.disabled.add(name)
+            if '.' in name and node_class in ('Input', 'Output'):
+                group_name = name.rsplit('.', 1)[0]
+                if node_class == 'Output':
+                    self.group_outputs[group_name] = name
+                    self.output_groups[name] = group_name
+                else:
+                    # headless read Input nodes have no number knob when it is 0
+                    number = node.knob('number')
+                    self.group_inputs[name] = (group_name, int(number.value()) if number is not None else 0)
+                    self.group_input_nodes[self.group_inputs[name]] = name
+        for name, node in self.nodes.items():
+            for i in range(node.inputs()):
+                input_node = node.input(i)
+                input_name = input_node.fullName() if input_node is not None else None
+                self.inputs[name].append(input_name)
+                if input_name is not None:
+                    self.outputs.setdefault(input_name, []).append((name, i))
+
+    def __len__(self):
+        return len(self.nodes)
+
+    def input_nodes(self, name) -> list:
+        """Input nodes by input index, None for empty inputs"""
+        return [self.nodes.get(input_name) if input_name is not None else None
+                for input_name in self.inputs.get(name, [])]
+
+    def output_nodes(self, name) -> list:
+        """(dependent node, input index) of every node connected to the output"""
+        return [(self.nodes[output_name], i) for output_name, i in self.outputs.get(name, [])
+                if output_name in self.nodes]
+
+    def is_disconnected(self, name) -> bool:
+        has_inputs = any(input_name is not None for input_name in self.inputs.get(name, []))
+        return not has_inputs and not self.outputs.get(name)
+
+    def replace(self, name, node):
+        """Swap the node object kept for name, connections stay"""
+        self.nodes[name] = node
+
+    def downstream(self, name, output_classes) -> list:
+        """
+        Enabled nodes of output_classes fed by the node, walked the same way as upstream().
+
+        :param name: full name of the node to start from
+        :param output_classes: node classes to find, Write nodes usually
+        :return: list of node full names
+        """
+
+        found = []
+        visited = set()
+        stack = [name]
+        while stack:
+            name = stack.pop()
+            if name in visited:
+                continue
+            visited.add(name)
+            if self.classes.get(name) in output_classes and name not in self.disabled:
+                found.append(name)
+            if name in self.output_groups:
+                stack.append(self.output_groups[name])
+            for output_name, i in self.outputs.get(name, []):
+                if output_name in self.disabled and i != 0:
+                    continue
+                if output_name in self.group_outputs:
+                    # enters the group through its Input node, black box groups are passed as a whole
+                    output_name = self.group_input_nodes.get((output_name, i), output_name)
+                stack.append(output_name)
+        return found
+
+    def upstream(self, output_classes):
+        """
+        Full names of all nodes feeding the enabled nodes of output_classes, outputs included.
+        Disabled nodes pass only input 0, groups are walked from their Output node,
+        their Input nodes lead to the group inputs.
+
+        :param output_classes: node classes to start from, Write nodes usually
+        :return: set of full names, None if the script has no enabled output node
+        """
+
+        stack = [name for name, node_class in self.classes.items()
+                 if node_class in output_classes and name not in self.disabled]
+        if not stack:
+            return None
+
+        reachable = set()
+        while stack:
+            name = stack.pop()
+            if name in reachable:
+                continue
+            reachable.add(name)
+            inputs = self.inputs.get(name, [])
+            if name in self.disabled:
+                inputs = inputs[:1]
+            elif name in self.group_outputs:
+                inputs = [self.group_outputs[name]]
+            elif name in self.group_inputs:
+                group_name, index = self.group_inputs[name]
+                group_inputs = self.inputs.get(group_name, [])
+                inputs = group_inputs[index:index + 1]
+            stack.extend(input_name for input_name in inputs if input_name is not None)
+        return reachable
 
 
 class PackNukeScript:
@@ -45,9 +1436,82 @@ class PackNukeScript:
         self.loaded_plugins = []
         self.categories = {}
         self.media_copy_list = []
+        hashes_algorithm = self.settings['hashes'].get('hashes_algorithm', 'blake2b')
+        self.hash_algorithm = resolve_hash_algorithm(hashes_algorithm)
+        if hashes_algorithm not in (self.hash_algorithm, 'fast'):
+            log.warning(f"Hash algorithm {hashes_algorithm} not available, using {self.hash_algorithm}.")
+        self.hash_cache = self.open_hash_cache()
+        self.object_store = self.open_object_store()
+        self.dir_cache = DirectoryCache()
+        self.hash_verify = {'verified': 0, 'mismatched': 0}
+        # evaluated TCL strings, kept for the whole run
+        self.tcl_cache = {}
+        # node connections, built by read_comp_data()
+        self.node_graph = None
+        # full names of nodes feeding the output nodes, None when nothing is pruned
+        self.reachable_nodes = None
+
+        # open Nuke script, or read it headless and open it in Nuke only for processing
+        self.script_open = False
+        self.nk_script = None
+        if self.settings.get('discovery', {}).get('headless', False):
+            self.nk_script = self.read_nk_script(nuke_script_full)
+        if self.nk_script is None:
+            self.open_script()
+
+    def read_nk_script(self, path):
+        """
+        Reads the script headless, with no Nuke license.
+        Returns None if anything in the script needs Nuke.
+        """
+        nk_script = NkScript.parse(path)
+        if nk_script.fallback_reasons:
+            for reason in nk_script.fallback_reasons:
+                log.info(f"Headless discovery not possible, {reason}")
+            return None
+        self.root_context = RootContext.from_nk(nk_script)
+        known_classes = self.settings.get('discovery', {}).get('known_classes', [])
+        nk_script.mark_gizmos(self.root_context.plugin_path, self.dir_cache.isfile, known_classes)
+        if nk_script.fallback_reasons:
+            for reason in nk_script.fallback_reasons:
+                log.info(f"Headless discovery not possible, {reason}")
+            return None
+        log.info(f"Headless discovery, {len(nk_script.nodes)} nodes read.")
+        return nk_script
 
-        # open Nuke script
-        nuke.scriptOpen(nuke_script_full)
+    def open_script(self):
+        """
+        Opens the script in Nuke.
+        After headless discovery, items and node graph are switched to the Nuke nodes.
+        """
+        if nuke is None:
+            raise RuntimeError(f"Nuke is needed to open {self.anatomy['script_path']}")
+        nuke.scriptOpen(self.anatomy['script_path'])
+        self.script_open = True
+        if self.nk_script is None:
+            self.root_context = RootContext.from_nuke()
+            return
+
+        for item in self.media_items + self.font_items + self.gizmo_items:
+            item['node'] = nuke.toNode(item['node_name'])
+        if self.node_graph is not None:
+            self.node_graph = NodeGraph(nuke.allNodes(recurseGroups=True))
+
+    def open_object_store(self):
+        """Open the package object store, if enabled by settings
+
+        Returns:
+             ObjectStore: Opened store, None if disabled or not accessible
+        """
+        _stngs = self.settings.get('object_store', {})
+        if not _stngs.get('enabled', False):
+            return None
+        store_path = self.settings['job']['path'] + '/_pack_nuke/objects'
+        try:
+            return ObjectStore(store_path, self.hash_algorithm, lock_timeout=float(_stngs.get('lock_timeout', 600)))
+        except OSError as e:
+            log.warning(f"Object store {store_path} not available, copying without it: {e}")
+            return None
 
     def get_default_category(self) -> dict:
         """Get the default category if not specified by settings
@@ -66,6 +1530,7 @@ class PackNukeScript:
                 "filter_options": {
                     "skip_disconnected": True,
                     "skip_disabled": True,
+                    "skip_unreachable": False,
                     "combine_filters": "AND"
                 },
                 "filters": [
@@ -81,6 +1546,25 @@ class PackNukeScript:
         }
         return default_category
 
+    def open_hash_cache(self):
+        """Open the persistent hash cache, if enabled by settings
+
+        Returns:
+             HashCache: Opened cache, None if disabled or not accessible
+        """
+        _stngs = self.settings['hashes']
+        if not _stngs.get('hashes_generate') or not _stngs.get('cache_enabled'):
+            return None
+        cache_path = _stngs.get('cache_path', '').replace('\\', '/')
+        if cache_path == '':
+            return None
+        try:
+            return HashCache(cache_path, algorithm=self.hash_algorithm,
+                             max_entries=int(_stngs.get('cache_max_entries', 1000000)))
+        except (OSError, sqlite3.Error) as e:
+            log.warning(f"Hash cache {cache_path} not available, hashing without cache: {e}")
+            return None
+
     def file_sequence_to_glob(self, path):
         """Helper function to convert a full path with printf or hash file sequence notation to glob filter
         foo\bar%04d.exr -> foo/bar.????.exr
@@ -126,6 +1610,12 @@ class PackNukeScript:
             return '{0:.2f} TB'.format(size_bytes / tb)
 
     def eval_tcl(self, text) -> str:
+        if not needs_tcl(text):
+            # nothing TCL would change, also the only text headless discovery gets here
+            return text
+        if text in self.tcl_cache:
+            return self.tcl_cache[text]
+
         val = ''
         try:
             val = nuke.tcl("[return \"" + text + "\"]")
@@ -137,8 +1627,43 @@ class PackNukeScript:
         if type(val) is not str:
             val = text
 
+        self.tcl_cache[text] = val
         return val
 
+    def eval_tcl_batch(self, texts) -> list:
+        """
+        Evaluates many TCL strings in one nuke.tcl call, every unique string only once per run.
+        Strings that could change their neighbours when joined (quotes, trailing backslash, unbalanced brackets)
+        and batches that fail or do not split back to the same count are evaluated one by one.
+
+        :param texts: strings to evaluate
+        :return: evaluated strings in the same order
+        """
+
+        batch = []
+        for text in dict.fromkeys(texts):
+            if not needs_tcl(text) or text in self.tcl_cache:
+                continue
+            if ('"' in text or text.endswith('\\') or TCL_BATCH_SEPARATOR in text
+                    or not tcl_brackets_balanced(text)):
+                self.eval_tcl(text)
+            else:
+                batch.append(text)
+
+        if len(batch) > 1:
+            values = None
+            try:
+                val = nuke.tcl("[return \"" + TCL_BATCH_SEPARATOR.join(batch) + "\"]")
+                if type(val) is str:
+                    values = val.split(TCL_BATCH_SEPARATOR)
+            except Exception as e:
+                # one of the strings breaks TCL, find it one by one
+                pass
+            if values is not None and len(values) == len(batch):
+                self.tcl_cache.update(zip(batch, values))
+
+        return [self.eval_tcl(text) for text in texts]
+
     def prepend_project_directory(self, path, project_dir=None, evaluate_project_directory=True):
         """
         prepend_project_directory: merge project directory with path.
@@ -149,10 +1674,10 @@ class PackNukeScript:
 
         if not project_dir:
             if evaluate_project_directory:
-                # Project directory can be TCL or Python expression, evaluate to path
-                project_dir = nuke.root()['project_directory'].evaluate()
+                # Project directory can be TCL or Python expression, evaluated once in root context
+                project_dir = self.root_context.project_directory
             else:
-                project_dir = nuke.root()['project_directory'].getValue()
+                project_dir = self.root_context.project_directory_raw
 
         full_path = path
         if project_dir:
@@ -171,56 +1696,78 @@ class PackNukeScript:
 
         return full_path
 
-    def get_real_knob_paths(self, knob_path):
+    def get_knob_views(self, knob_path) -> list:
         """
-        Returns all paths one file knob could refer to.
-        Paths are absolute, no backslashes.
+        Returns knob path for every view (%v, %V), not evaluated yet.
 
         :param knob_path:
-        :return: list of absolute paths
+        :return: list of paths
         """
 
-        # container for all found paths in sequence
-        paths = []
         # all versions of knob_path (stereo views, %v)
         view_files = []
-        # project directory relative path
-        project_dir = False
 
         # check if stereo files are used
         if r'%v' in knob_path or r'%V' in knob_path:
-            # get all stereo views in the comp
-            view_return = nuke.root().knob('views').toScript()
-            for rtn in view_return.split('\n'):
-                # get each view name in the nuke comp
-                view = rtn.split(' ')[-2]
+            # all stereo views in the comp
+            for view in self.root_context.views:
                 # replace in path and append to view_files
                 view_files.append(knob_path.replace(r'%v', view).replace(r'%V', view))
         else:
             # if if stereo files not used, do not replace anything
             view_files = [knob_path]
 
-        # overwrite knob_path value with new value per view
+        return view_files
+
+    def get_knob_view_paths(self, knob_path) -> list:
+        """
+        Returns TCL evaluated knob path for every view (%v, %V), uses Nuke API, main thread only.
+
+        :param knob_path:
+        :return: list of evaluated paths
+        """
+
+        # get TCL evaluated string
+        return self.eval_tcl_batch(self.get_knob_views(knob_path))
+
+    def resolve_knob_paths(self, view_paths, project_directory):
+        """
+        Finds all files of already evaluated view paths.
+        Only touches the file system, no Nuke API, so it can run in a thread pool.
+
+        :param view_paths: TCL evaluated knob path for every view
+        :param project_directory: evaluated root project directory
+        :return: FileSet with one FileSequence per view
+        """
+
+        # container for all found sequences
+        file_set = FileSet()
+        # project directory relative path
+        project_dir = False
+
+        def prepend_project_directory(path):
+            if not project_directory:
+                return path
+            return self.prepend_project_directory(path, project_dir=project_directory)
+
         # TODO per view file hashes
-        for knob_path in view_files:
+        for knob_path_tcl in view_paths:
 
-            # get TCL evaluated string
-            knob_path_tcl = self.eval_tcl(knob_path)
             path_with_hashes = knob_path_tcl
 
             # get parent directory
             knob_path_parent_dir = os.path.dirname(knob_path_tcl)
 
             # try appending project root folder, if the dir does not exist
-            if not os.path.exists(knob_path_parent_dir):
-                knob_path_project_dir = self.prepend_project_directory(knob_path_parent_dir)
-                if os.path.isdir(knob_path_project_dir):
+            if not self.dir_cache.exists(knob_path_parent_dir):
+                knob_path_project_dir = prepend_project_directory(knob_path_parent_dir)
+                if knob_path_project_dir != knob_path_parent_dir and self.dir_cache.isdir(knob_path_project_dir):
                     project_dir = True
                     knob_path_parent_dir = knob_path_project_dir
-                    knob_path_tcl = self.prepend_project_directory(knob_path_tcl)
+                    knob_path_tcl = prepend_project_directory(knob_path_tcl)
 
             # check if the parent dir exists
-            if os.path.exists(knob_path_parent_dir):
+            if self.dir_cache.exists(knob_path_parent_dir):
                 # if it does, get the filename
                 filename = knob_path_tcl.split('/')[-1]
                 # get number from printf notation as int
@@ -242,9 +1789,9 @@ class PackNukeScript:
                         wildcards += '?'
                     wildcard_path = knob_path_tcl.replace(regex_file, wildcards)
                     # get all files in directory
-                    files = glob.glob(wildcard_path)
-                    for each_file in files:
-                        paths.append(each_file.replace('\\', '/'))
+                    prefix, suffix = filename.split(regex_file, 1)
+                    file_set.append(FileSequence.from_listing(os.path.dirname(knob_path_tcl), prefix, printf_count,
+                                                              suffix, self.dir_cache))
                     path_with_hashes = wildcard_path.replace('?', '#')
 
                 # if hash notation is used for the sequence
@@ -263,30 +1810,275 @@ class PackNukeScript:
                     wildcard_path = os.path.join(knob_path_parent_dir, filename).replace('\\', '/')
 
                     # get all files that match wildcard pattern
-                    files = glob.glob(wildcard_path)
-                    for each_file in files:
-                        paths.append(each_file.replace('\\', '/'))
+                    file_set.append(FileSequence.from_listing(os.path.dirname(wildcard_path), filename_split[0],
+                                                              wildcard_count + 1, filename_split[-1], self.dir_cache))
                     path_with_hashes = wildcard_path.replace('?', '#')
 
                 # if not a sequence
                 else:
                     # append this file to paths, if it exists
-                    if os.path.isfile(knob_path_tcl):
-                        paths.append(knob_path_tcl)
+                    if self.dir_cache.isfile(knob_path_tcl):
+                        file_set.append(FileSequence.from_file(knob_path_tcl, self.dir_cache.getsize(knob_path_tcl)))
 
                     # check if it is a relative (project directory) path
-                    elif os.path.isfile(self.prepend_project_directory(knob_path_tcl)):
-                        paths.append(self.prepend_project_directory(knob_path_tcl))
+                    else:
+                        project_path = prepend_project_directory(knob_path_tcl)
+                        if project_path != knob_path_tcl and self.dir_cache.isfile(project_path):
+                            file_set.append(FileSequence.from_file(project_path, self.dir_cache.getsize(project_path)))
 
         # return result
-        return paths, project_dir, path_with_hashes.replace('#', '?')
+        return file_set, project_dir, path_with_hashes.replace('#', '?')
+
+    def hash_file(self, path) -> str:
+        """Full content hash of the file, for anything that compares content even without hashes_generate"""
+        stat = None
+        if self.hash_cache is not None:
+            # stat before reading, a file changed during hashing will not match next time
+            stat = self.dir_cache.cache_stat(path)
+            my_hash = self.hash_cache.get(path, stat)
+            if my_hash is not None:
+                return my_hash
+        # stream the file in fixed size chunks, the digest is identical to hashing the whole file at once
+        hasher = HASH_ALGORITHMS[self.hash_algorithm]()
+        buffer = bytearray(HASH_CHUNK_SIZE)
+        view = memoryview(buffer)
+        with open(path, 'rb', buffering=0) as one_file:
+            while True:
+                read = one_file.readinto(buffer)
+                if not read:
+                    break
+                hasher.update(view[:read])
+        my_hash = hasher.hexdigest()
+        if self.hash_cache is not None:
+            self.hash_cache.set(path, stat, my_hash)
+        return my_hash
+
+    def get_file_fingerprint(self, path) -> str:
+        """
+        Cheap fingerprint of the file from its size, first and last fingerprint_kb of content.
+        Same length as the full hash, but only identifies the file with high probability.
+        """
+        chunk = int(self.settings['hashes'].get('fingerprint_kb', 64)) * 1024
+        size = self.dir_cache.stat(path).st_size
+        hasher = HASH_ALGORITHMS[self.hash_algorithm]()
+        hasher.update(str(size).encode())
+        with open(path, 'rb') as one_file:
+            hasher.update(one_file.read(chunk))
+            if size > chunk:
+                one_file.seek(max(chunk, size - chunk))
+                hasher.update(one_file.read(chunk))
+        return hasher.hexdigest()
+
+    def get_file_stat_fingerprint(self, path) -> str:
+        """
+        Fingerprint from file size and modification time only, for packing without hashing.
+        Hex string like the hashes, so hash_for_all and merkle tree work the same way.
+        """
+        stat = self.dir_cache.stat(path)
+        return f'{stat.st_size:016x}{stat.st_mtime_ns:016x}'
+
+    def map_files(self, func, paths, threads=None):
+        """
+        Run func for every path, optionally in a thread pool.
+        Returned values are in the same order as paths.
+        """
+        if threads is None:
+            threads = self.settings['hashes'].get('hashes_threads', 1)
+        threads = int(threads or 1)
+        if threads <= 1 or len(paths) <= 1:
+            return [func(path) for path in paths]
+        with concurrent.futures.ThreadPoolExecutor(max_workers=min(threads, len(paths))) as executor:
+            # map keeps the order of paths, so the hash_for_all stays deterministic
+            return list(executor.map(func, paths))
+
+    def imap_files(self, func, items, threads=None):
+        """
+        Like map_files(), but yields the results in order as they come, items can be a generator
+        """
+        if threads is None:
+            threads = self.settings['hashes'].get('hashes_threads', 1)
+        threads = int(threads or 1)
+        if threads <= 1:
+            yield from map(func, items)
+            return
+        with concurrent.futures.ThreadPoolExecutor(max_workers=threads) as executor:
+            yield from executor.map(func, items)
+
+    def get_file_hashes(self, paths):
+        return self.map_files(self.hash_file, paths)
+
+    def get_file_fingerprints(self, paths):
+        return self.map_files(self.get_file_fingerprint, paths)
+
+    def hash_mode(self) -> str:
+        """
+        full, tiered or stat (no hashes_generate).
+        Object store claims objects by hash before copying, so with the store every file is hashed in full.
+        """
+        _stngs = self.settings['hashes']
+        if self.object_store is not None:
+            return 'full'
+        if not _stngs['hashes_generate']:
+            return 'stat'
+        return 'tiered' if _stngs.get('hashes_mode', 'full') == 'tiered' else 'full'
+
+    def hash_paths(self, paths):
+        """
+        Hashes every path only once.
+        In tiered mode the fast fingerprint is kept, unless it collides with fingerprint of another path,
+        then the full hash is computed. Without hashes_generate, files are never read, size and mtime are used.
+        :param paths: list of file paths
+        :return: {path: hash}, {path: hash tier}
+        """
+
+        paths = list(dict.fromkeys(paths))
+        hashes = {}
+        tiers = {}
+        hash_mode = self.hash_mode()
+        if hash_mode == 'stat':
+            hashes.update(zip(paths, self.map_files(self.get_file_stat_fingerprint, paths)))
+            tiers.update(dict.fromkeys(paths, 'stat'))
+            paths = []
+        elif hash_mode == 'tiered':
+            fingerprints = dict(zip(paths, self.get_file_fingerprints(paths)))
+            paths_by_fingerprint = {}
+            for path, fingerprint in fingerprints.items():
+                paths_by_fingerprint.setdefault(fingerprint, []).append(path)
+            collided = [path for path, fingerprint in fingerprints.items()
+                        if len(paths_by_fingerprint[fingerprint]) > 1]
+            hashes.update(fingerprints)
+            tiers.update(dict.fromkeys(paths, 'fast'))
+            paths = collided
+        hashes.update(zip(paths, self.get_file_hashes(paths)))
+        tiers.update(dict.fromkeys(paths, 'full'))
+        return hashes, tiers
+
+    def hash_sequence_files(self, sequences, func, tier, select=None):
+        """
+        Hashes files of all sequences with func in one thread pool,
+        every hash is written straight into the packed buffer of its sequence.
+        :param select: optional select(sequence, index), files to hash, all files by default
+        """
+
+        def hash_one(one):
+            sequence, i = one
+            return sequence, i, func(sequence.path(i))
+
+        files = ((sequence, i) for sequence in sequences for i in range(len(sequence))
+                 if select is None or select(sequence, i))
+        for sequence, i, file_hash in self.imap_files(hash_one, files):
+            sequence.set_hash(i, file_hash, tier)
+
+    def hash_sequences(self, sequences):
+        """
+        Same tiers as hash_paths(), but without a path or hash dict of all frames.
+        Tiered mode keeps only a set of fingerprint digests to find the collisions.
+        """
+        hash_mode = self.hash_mode()
+        if hash_mode == 'stat':
+            self.hash_sequence_files(sequences, self.get_file_stat_fingerprint, 'stat')
+            return
+        if hash_mode == 'full':
+            self.hash_sequence_files(sequences, self.hash_file, 'full')
+            return
+        self.hash_sequence_files(sequences, self.get_file_fingerprint, 'fast')
+        seen = set()
+        collided = set()
+        for sequence in sequences:
+            for i in range(len(sequence)):
+                digest = bytes(sequence.get_digest(i))
+                if digest in seen:
+                    collided.add(digest)
+                else:
+                    seen.add(digest)
+        seen.clear()
+        if collided:
+            self.hash_sequence_files(sequences, self.hash_file, 'full',
+                                     select=lambda sequence, i: bytes(sequence.get_digest(i)) in collided)
+
+    def hash_for_all(self, hashes) -> str:
+        """
+        Hash of concatenated file hashes, identifies the whole file sequence
+        """
+        hasher = HASH_ALGORITHMS[self.hash_algorithm]()
+        for one_hash in hashes:
+            hasher.update(one_hash.encode())
+        return hasher.hexdigest()
+
+    def hash_tier_for_all(self, tiers) -> str:
+        """
+        full or fast if all files share the tier, mixed otherwise
+        """
+        tiers = set(tiers)
+        if len(tiers) == 1:
+            return tiers.pop()
+        return 'mixed' if tiers else ''
+
+    def hash_algorithm_for_tier(self, tier) -> str:
+        """
+        Hash algorithm for the report, empty for stat fingerprints and missing hashes
+        """
+        return self.hash_algorithm if tier in ('full', 'fast', 'mixed') else ''
+
+    def is_copy_and_hash(self) -> bool:
+        """
+        Files are hashed while being copied, instead of the separate hash_items() pass
+        """
+        _stngs = self.settings['hashes']
+        if self.object_store is not None:
+            # objects are named by hash, every copied file is hashed
+            return True
+        return bool(_stngs['hashes_generate'] and _stngs.get('copy_and_hash', False))
+
+    def hash_items(self):
+        """
+        Hashes only the files that will be copied to the package.
+        Runs after media_items_to_categories and find duplicities,
+        skipped duplicates and media items without category are never read.
+        Without hashes_generate, size and mtime fingerprints are used instead of hashes.
+        With the object store, files are hashed before copying, so parallel tasks claim each object by its hash
+        and only the task that claims it writes it, see store_file_and_hash().
+        """
+
+        if self.is_copy_and_hash() and self.object_store is None:
+            # every hashed file is copied, copy_file_and_hash() reads it only once
+            return
+
+        copied_media = [media_item for media_item in self.media_items
+                        if media_item['duplicate_of'] is None and media_item['categories']]
+        hash_ocio = (self.ocio['color_management'] == 'OCIO' and self.ocio['ocio_config'] == 'custom'
+                     and self.ocio['all_files'])
+
+        # media sequences are hashed in place, only fonts, gizmos and OCIO files go through path lists
+        self.hash_sequences([sequence for media_item in copied_media
+                             for sequence in media_item['all_files'].sequences])
+        for media_item in copied_media:
+            media_item['hash_for_all'] = self.hash_for_all(media_item['all_files'].hashes())
+
+        file_items = [item for item in self.font_items + self.gizmo_items
+                      if item['duplicate_of'] is None and item['path']]
+        paths = [item['path'] for item in file_items]
+        if hash_ocio:
+            paths += [one_file['path'] for one_file in self.ocio['all_files']]
+
+        hashes, tiers = self.hash_paths(paths)
+
+        for item in file_items:
+            item['file_hash'] = hashes[item['path']]
+            item['hash_tier'] = tiers[item['path']]
+        if hash_ocio:
+            for one_file in self.ocio['all_files']:
+                one_file['hash'] = hashes[one_file['path']]
+                one_file['hash_tier'] = tiers[one_file['path']]
+            self.ocio['hash_for_all'] = self.hash_for_all(one_file['hash'] for one_file in self.ocio['all_files'])
 
     def read_comp_data(self):
         """
         Gets all file knobs in Nuke file
-        Runs them through get_real_knob_paths()
+        Finds their files in a thread pool, see resolve_knob_paths()
         Gets size of every file
         Calculates media_item total size
+        Hashing is deferred to hash_items()
         Notes disabled nodes
         Makes media_item
         Merges duplicities
@@ -301,9 +2093,9 @@ class PackNukeScript:
             all_files = []
             total_size = 0
             hash_for_all = ''
-            color_management = nuke.root().knob('colorManagement').value()
+            color_management = self.root_context.color_management
             custom_path = ''
-            cfg = nuke.root().knob('OCIO_config').value()
+            cfg = self.root_context.ocio_config
 
             if os.environ.get('OCIO') is not None:
                 # env has precedence
@@ -313,21 +2105,17 @@ class PackNukeScript:
 
                 if cfg == 'custom':
                     # read custom
-                    custom_path = os.path.abspath(nuke.root().knob('customOCIOConfigPath').evaluate()).replace("\\", "/")
+                    custom_path = os.path.abspath(self.root_context.custom_ocio_config_path).replace("\\", "/")
 
             if custom_path != '':
-                files = glob.glob(os.path.dirname(custom_path) + '/**', recursive=True)
-                files = [f.replace("\\", "/") for f in files if os.path.isfile(f)]
+                files = self.dir_cache.walk_files(os.path.dirname(custom_path))
                 if files is not None and len(files) > 0:
                     # get total file size
-                    all_hashes = ''
+                    # hashes are filled later by hash_items()
                     for each_file in files:
-                        size = os.path.getsize(each_file)
+                        size = self.dir_cache.getsize(each_file)
                         total_size += size
-                        my_hash = get_file_hash(each_file)
-                        all_hashes += my_hash
-                        all_files.append({'path': each_file, 'size': size, 'hash': my_hash})
-                    hash_for_all = hashlib.blake2b(all_hashes.encode()).hexdigest()
+                        all_files.append({'path': each_file, 'size': size, 'hash': None})
 
             self.ocio = {
                 'color_management': color_management,
@@ -341,28 +2129,81 @@ class PackNukeScript:
             return self.ocio
 
         def is_node_disconnected(node):
+            # has no inputs and no outputs, answered by the node graph
+            return self.node_graph.is_disconnected(node.fullName())
 
-            disconnected = False
-            # can have outputs and has no outputs
-            no_outs = False
-            no_ins = False
-            if node.dependent() == []:
-                no_outs = True
-            if node.dependencies() == []:
-                no_ins = True
-            if no_outs and no_ins:
-                disconnected = True
-
-            return disconnected
+        def is_node_reachable(node):
+            # feeds an output node, everything is reachable in scripts without outputs
+            return self.reachable_nodes is None or node.fullName() in self.reachable_nodes
 
         def is_node_gizmo(node):
             # check if a node is a gizmo, and if so, return the full name
 
-            if type(node) == nuke.Gizmo:
+            if isinstance(node, NkNode):
+                is_gizmo = node.gizmo
+            else:
+                is_gizmo = type(node) == nuke.Gizmo
+            if is_gizmo:
                 return node.Class() if node.Class().endswith('.gizmo') else node.Class() + '.gizmo'
             else:
                 return ''
 
+        def get_file_knob_names(node, node_knobs, gizmo_name):
+            """
+            Names of File_Knob and FreeType_Knob knobs of the node.
+            Indexed by node class, the knobs are scanned only for the first node of a class.
+            Nodes with knobs that differ from the index (user knobs) are scanned again.
+            """
+            node_class = node.Class()
+            indexed = gizmo_name == '' and node_class not in knob_index_skip
+            if indexed:
+                schema = knob_index.get(node_class)
+                if schema is not None and node_knobs.keys() == schema[0]:
+                    return schema[1]
+            names = [name for name, knob in node_knobs.items() if knob.Class() in ('File_Knob', 'FreeType_Knob')]
+            if indexed:
+                knob_index[node_class] = (set(node_knobs), names)
+            return names
+
+        def get_trim_range(node):
+            """
+            Frames of a Read node the comp can use, None keeps all frames found on the storage.
+            'read' mode uses Read first and last widened by handles,
+            'write' mode also narrows them to the ranges of enabled Writes fed by the Read.
+            Retimes between the Read and the Writes are not followed.
+            """
+            if trim_frames not in ('read', 'write') or node.Class() != 'Read':
+                return None
+            if get_knob_value(node, 'frame'):
+                # frame expression or offset can read any frame of the sequence
+                return None
+            _first = get_knob_value(node, 'first')
+            _last = get_knob_value(node, 'last')
+            if _first is None or _last is None:
+                return None
+            first = int(str(_first).strip()) - trim_handles
+            last = int(str(_last).strip()) + trim_handles
+
+            if trim_frames == 'write':
+                write_ranges = []
+                for write_name in self.node_graph.downstream(node.fullName(), output_classes):
+                    write = self.node_graph.nodes[write_name]
+                    range_first = self.root_context.first_frame
+                    range_last = self.root_context.last_frame
+                    if get_knob_value(write, 'use_limit'):
+                        # knobs left at default are not saved in the script read headless, root range is used
+                        if get_knob_value(write, 'first') is not None:
+                            range_first = int(get_knob_value(write, 'first'))
+                        if get_knob_value(write, 'last') is not None:
+                            range_last = int(get_knob_value(write, 'last'))
+                    write_ranges.append((range_first, range_last))
+                if write_ranges:
+                    write_first = max(first, min(one[0] for one in write_ranges) - trim_handles)
+                    write_last = min(last, max(one[1] for one in write_ranges) + trim_handles)
+                    if write_first <= write_last:
+                        first, last = write_first, write_last
+            return first, last
+
         def get_knob_value(node, knob_name):
             """Return the value of a knob or return None if it is missing"""
             value = None
@@ -387,30 +2228,19 @@ class PackNukeScript:
                         custom_plugins.append(plugin)
             return custom_plugins
 
-        def get_file_hash(path):
-            my_hash = None
-            if self.settings['hashes']['hashes_generate']:
-                one_file = open(path, 'rb')
-                try:
-                    # read all file at once, memory hungry but faster
-                    my_hash = hashlib.blake2b(one_file.read()).hexdigest()
-                finally:
-                    one_file.close()
-            return my_hash
-
         def store_gizmo_item(gizmo_name, gizmo_items, each_node, node_disabled, node_disconnected):
 
             if gizmo_name != '':
 
                 gizmo_path_found = False
                 gizmo_path = ''
-                for each_plugin_path in nuke.pluginPath():
+                for each_plugin_path in self.root_context.plugin_path:
                     gizmo_path = os.path.join(each_plugin_path, gizmo_name).replace('\\', '/')
-                    if os.path.isfile(gizmo_path):
+                    if self.dir_cache.isfile(gizmo_path):
                         gizmo_path_found = True
                         break
                 if gizmo_path_found:
-                    if os.path.isfile(gizmo_path):
+                    if self.dir_cache.isfile(gizmo_path):
                         gizmo_item = {
                             'gizmo_name': gizmo_name,
                             'path': gizmo_path,
@@ -419,8 +2249,8 @@ class PackNukeScript:
                             'node_disabled': node_disabled,
                             'node_disconnected': node_disconnected,
                             'node': each_node,
-                            'size': os.path.getsize(gizmo_path),
-                            'file_hash': get_file_hash(gizmo_path),
+                            'size': self.dir_cache.getsize(gizmo_path),
+                            'file_hash': None,
                             'duplicate_of': None,
                         }
                         gizmo_items.append(gizmo_item)
@@ -439,7 +2269,7 @@ class PackNukeScript:
             # https://learn.foundry.com/nuke/developers/latest/pythondevguide/_autosummary/nuke.getFonts.html
 
             # list of lists: [font_family, font_style, path, index]
-            all_fonts = nuke.getFonts()
+            all_fonts = nuke.getFonts() if nuke is not None else []
 
             if font_items and len(font_items) > 0:
                 # get all fonts as list of lists ["Open Sans", "Regular", "fontapath", somenumber]:
@@ -464,33 +2294,18 @@ class PackNukeScript:
                                 found_font['font_index'] = font[3]
                                 break
 
-                # now path is there, get size and hash
+                # now path is there, get size, hash is filled by hash_items()
                 for found_font in font_items:
-                    found_font['size'] = os.path.getsize(found_font['path'])
-                    found_font['file_hash'] = get_file_hash(found_font['path'])
+                    found_font['size'] = self.dir_cache.getsize(found_font['path'])
+                    found_font['file_hash'] = None
 
             return font_items
 
-        def get_media_item(node, knob, path, disabled, disconnected):
-            # get real paths (file path list + project dir bool)
-            real_knob_paths, project_dir, path_with_question_marks = self.get_real_knob_paths(path)
-
-            # make new list for new paths with their per-file size included
-            all_files = []
-
-            # get total file size
-            total_size = 0
-            if real_knob_paths is None:
-                return None
-
-            all_hashes = ''
-            for each_file in real_knob_paths:
-                size = os.path.getsize(each_file)
-                total_size += size
-                my_hash = get_file_hash(each_file)
-                all_hashes += my_hash
-                all_files.append({'path': each_file, 'size': size, 'hash': my_hash})
-            hash_for_all = hashlib.blake2b(all_hashes.encode()).hexdigest()
+        def get_media_item(node, knob, path, disabled, disconnected, view_paths):
+            """
+            Makes media item from node and knob info, main thread only.
+            Files are found later by resolve_media_items()
+            """
 
             # transform type in Nuke 15+, being colorspace/display
             # the display value needs ocioDisplay, ocioView
@@ -500,11 +2315,11 @@ class PackNukeScript:
             _cs = get_knob_value(node, 'colorspace')
             # for default colorspace, do a wild guess by nuke defaults and file extension
             if _cs is not None and _cs == 'default':
-                file_name = path_with_question_marks.split('/')[-1]
+                file_name = view_paths[-1].split('/')[-1]
                 extension = file_name.split('.')[-1]
-                _cs = nuke.root()['floatLut'].value()
+                _cs = self.root_context.float_lut
                 if extension != 'exr':
-                    _cs = nuke.root()['int8Lut'].value()
+                    _cs = self.root_context.int8_lut
 
             _read_range = '-'
             if node.Class() == 'Read':
@@ -521,25 +2336,47 @@ class PackNukeScript:
                 'color_view': get_knob_value(node, 'ocioView'),
                 'color_raw': get_knob_value(node, 'raw'),
                 'read_range': _read_range,
+                'trim_range': get_trim_range(node),
                 'knob': knob,
                 'node_class': node.Class(),
                 'node_name': node.fullName(),
                 'found_path': path,
-                'found_path_filter': path_with_question_marks,
-                'all_files': all_files,
-                'hash_for_all': hash_for_all,
-                'total_size': total_size,
-                'project_dir': project_dir,
+                'found_path_filter': view_paths[-1],
+                'all_files': FileSet(),
+                'hash_for_all': '',
+                'total_size': 0,
+                'project_dir': False,
                 'node_disabled': disabled,
                 'node_disconnected': disconnected,
+                'node_reachable': is_node_reachable(node),
+                'pruned': False,
                 'categories': [],
                 'category_files': {},
                 'tokens': {},
                 'duplicate_of': None,
+                'merged_items': 0,
                 'exist_on_target': False
             }
             return item
 
+        def resolve_media_items(media_items, media_view_paths):
+            """
+            Finds files of all media items in a thread pool, keeps the media items order.
+            Only the file system is used here, all Nuke API calls are done before.
+            """
+            project_directory = self.root_context.project_directory
+            threads = self.settings.get('discovery', {}).get('threads', 1)
+            resolved = self.map_files(lambda view_paths: self.resolve_knob_paths(view_paths, project_directory),
+                                      media_view_paths, threads=threads)
+            for media_item, (all_files, project_dir, path_with_question_marks) in zip(media_items, resolved):
+                # hashes are filled later by hash_items(), only for files that will be copied
+                if media_item['trim_range'] is not None:
+                    all_files.trim(*media_item['trim_range'])
+                media_item['all_files'] = all_files
+                media_item['total_size'] = all_files.total_size
+                media_item['project_dir'] = project_dir
+                media_item['found_path_filter'] = path_with_question_marks
+
 
         # OCIO first
         log.info("Read OCIO")
@@ -547,15 +2384,36 @@ class PackNukeScript:
         log.info(pprint.pformat(self.ocio, indent=4))
 
         # progress bar total value
-        all_nodes = nuke.allNodes(recurseGroups=True)
+        if self.nk_script is not None:
+            all_nodes = self.nk_script.nodes
+        else:
+            all_nodes = nuke.allNodes(recurseGroups=True)
         progress_total = len(all_nodes)
 
+        # all node connections in one pass
+        self.node_graph = NodeGraph(all_nodes)
+        log.info(f"Node graph: {len(self.node_graph)} nodes.")
+        output_classes = self.settings.get('discovery', {}).get('reachability_outputs',
+                                                                 ['Write', 'DeepWrite', 'WriteGeo'])
+        trim_frames = self.settings.get('discovery', {}).get('trim_frames', 'none')
+        trim_handles = self.settings.get('discovery', {}).get('trim_handles', 0)
+        self.reachable_nodes = self.node_graph.upstream(output_classes)
+        if self.reachable_nodes is None:
+            log.warning(f"No enabled {' '.join(output_classes)} node, unreachable nodes are not pruned.")
+        else:
+            log.info(f"{len(self.reachable_nodes)} nodes feed the output nodes.")
+
         # container for all loaded files
         media_items = []
+        media_view_paths = []
+        media_knobs = []
+        # node class: (all knob names, file and font knob names)
+        knob_index = {}
+        knob_index_skip = self.settings.get('discovery', {}).get('knob_index_skip_classes', ['Group', 'LiveGroup'])
         gizmo_items = []
         font_items = []
 
-        # collect all knobs with files in them
+        # collect all knobs with files in them, phase one: Nuke API on the main thread
         i_node = 0
         for each_node in all_nodes:
 
@@ -572,9 +2430,10 @@ class PackNukeScript:
             if gizmo_name != '':
                 gizmo_items = store_gizmo_item(gizmo_name, gizmo_items, each_node, node_disabled, node_disconnected)
 
-            # Check all knobs in Node
-            for each_knob in each_node.knobs():
-                curr_knob = each_node[each_knob]
+            # Check file and font knobs in Node
+            node_knobs = each_node.knobs()
+            for each_knob in get_file_knob_names(each_node, node_knobs, gizmo_name):
+                curr_knob = node_knobs[each_knob]
 
                 # File resource
                 if curr_knob.Class() == 'File_Knob':
@@ -602,11 +2461,9 @@ class PackNukeScript:
                             font_items.append(one_font)
 
                         else:
-                            # file knob that is not a font
-                            media_item = get_media_item(each_node, curr_knob, found_path, node_disabled,
-                                                        node_disconnected)
-                            if media_item is not None:
-                                media_items.append(media_item)
+                            # file knob that is not a font, TCL is evaluated for all knobs at once below
+                            media_knobs.append((each_node, curr_knob, found_path, node_disabled,
+                                                node_disconnected))
 
                 # Font resource
                 elif curr_knob.Class() == 'FreeType_Knob':
@@ -634,11 +2491,25 @@ class PackNukeScript:
             # print('Done {}% of Nodes'.format(percent))
             i_node += 1
 
+        # evaluate TCL of all file knobs in one call, then make the media items
+        self.eval_tcl_batch([view_file for media_knob in media_knobs
+                             for view_file in self.get_knob_views(media_knob[2])])
+        for each_node, curr_knob, found_path, node_disabled, node_disconnected in media_knobs:
+            view_paths = self.get_knob_view_paths(found_path)
+            media_item = get_media_item(each_node, curr_knob, found_path, node_disabled,
+                                        node_disconnected, view_paths)
+            if media_item is not None:
+                media_items.append(media_item)
+                media_view_paths.append(view_paths)
+
+        # phase two: find the files on the storage in a thread pool
+        resolve_media_items(media_items, media_view_paths)
+
         self.media_items = media_items
         log.info(pprint.pformat(self.media_items, indent=4))
         self.font_items = get_font_info(font_items)
         self.gizmo_items = gizmo_items
-        self.loaded_plugins = get_loaded_plugins()
+        self.loaded_plugins = get_loaded_plugins() if nuke is not None else []
 
     def make_report(self):
 
@@ -648,9 +2519,10 @@ class PackNukeScript:
             if one['duplicate_of'] is None:
                 number_of_files = len(one['all_files'])
                 if number_of_files == 1:
-                    hash = one['all_files'][0]['hash']
+                    hash = one['all_files'].get_hash(0)
                 else:
                     hash = ''
+                hash_tier = self.hash_tier_for_all(one['all_files'].tiers())
                 file_name = one['found_path_filter'].split('/')[-1]
                 extension = file_name.split('.')[-1]
                 if one['color_space'] is not None and one['color_space'] is None:
@@ -661,6 +2533,11 @@ class PackNukeScript:
                     color_info = ''
                 if one['color_raw'] is not None and one['color_raw']:
                     color_info += ':raw'
+                if any(sequence.trimmed for sequence in one['all_files'].sequences):
+                    frames = [frame for sequence in one['all_files'].sequences for frame in sequence.frames]
+                    color_info += f"; trimmed:{min(frames)}-{max(frames)}"
+                if one['merged_items']:
+                    color_info += f"; merged:{one['merged_items']}"
 
                 item = {
                     'type': 'media',
@@ -675,8 +2552,11 @@ class PackNukeScript:
                     'node_disconnected': one['node_disconnected'],
                     'path': one['found_path'],
                     'file_hash': hash,
+                    'hash_tier': hash_tier,
+                    'hash_algorithm': self.hash_algorithm_for_tier(hash_tier),
                     'file_number': number_of_files,
                     'hash_for_all': one['hash_for_all'],
+                    'merkle_root': merkle_root(one['all_files'].leaf_digests()) if one['hash_for_all'] else '',
                     'place_source': self.anatomy['place_source'],
                     'place_target': self.anatomy['place_target'],
                     'timestamp': self.anatomy['timestamp']
@@ -701,8 +2581,11 @@ class PackNukeScript:
                     'node_disconnected': one['node_disconnected'],
                     'path': one['path'],
                     'file_hash': one['file_hash'],
+                    'hash_tier': one.get('hash_tier', ''),
+                    'hash_algorithm': self.hash_algorithm_for_tier(one.get('hash_tier')),
                     'file_number': 1,
                     'hash_for_all': '',
+                    'merkle_root': '',
                     'place_source': self.anatomy['place_source'],
                     'place_target': self.anatomy['place_target'],
                     'timestamp': self.anatomy['timestamp']
@@ -726,8 +2609,11 @@ class PackNukeScript:
                     'node_disconnected': one['node_disconnected'],
                     'path': one['path'],
                     'file_hash': one['file_hash'],
+                    'hash_tier': one.get('hash_tier', ''),
+                    'hash_algorithm': self.hash_algorithm_for_tier(one.get('hash_tier')),
                     'file_number': 1,
                     'hash_for_all': '',
+                    'merkle_root': '',
                     'place_source': self.anatomy['place_source'],
                     'place_target': self.anatomy['place_target'],
                     'timestamp': self.anatomy['timestamp']
@@ -748,8 +2634,11 @@ class PackNukeScript:
                 'node_disconnected': False,
                 'path': '',
                 'file_hash': '',
+                'hash_tier': '',
+                'hash_algorithm': '',
                 'file_number': 0,
                 'hash_for_all': '',
+                'merkle_root': '',
                 'place_source': '',
                 'place_target': '',
                 'timestamp': self.anatomy['timestamp']
@@ -761,6 +2650,7 @@ class PackNukeScript:
         for k, v in self.ocio.items():
             if k in ['color_management', 'ocio_config', 'custom_path']:
                 t += f"{k}:{v}; "
+        ocio_hash_tier = self.hash_tier_for_all(one_file.get('hash_tier', '') for one_file in self.ocio['all_files'])
         item = {
             'type': 'color_management',
             'info': t,
@@ -774,14 +2664,144 @@ class PackNukeScript:
             'node_disconnected': False,
             'path': '',
             'file_hash': '',
+            'hash_tier': ocio_hash_tier,
+            'hash_algorithm': self.hash_algorithm_for_tier(ocio_hash_tier),
             'file_number': len(self.ocio['all_files']),
             'hash_for_all': self.ocio['hash_for_all'],
+            'merkle_root': '',
             'place_source': '',
             'place_target': '',
             'timestamp': self.anatomy['timestamp']
         }
         report.append(item)
 
+        item = {
+            'type': 'missing_paths',
+            'info': f"missing:{len(self.dir_cache.missing)}; hits:{self.dir_cache.missing_hits}; ",
+            'node_class': '',
+            'node_name': '',
+            'file_name': '',
+            'extension': '',
+            'size': 0,
+            'categories': '',
+            'node_disabled': False,
+            'node_disconnected': False,
+            'path': '',
+            'file_hash': '',
+            'hash_tier': '',
+            'hash_algorithm': '',
+            'file_number': 0,
+            'hash_for_all': '',
+            'merkle_root': '',
+            'place_source': '',
+            'place_target': '',
+            'timestamp': self.anatomy['timestamp']
+        }
+        report.append(item)
+
+        # media not copied only because they do not feed any output node
+        pruned = [one for one in self.media_items
+                  if one['duplicate_of'] is None and one['pruned'] and not one['categories']]
+        item = {
+            'type': 'unreachable',
+            'info': f"pruned:{len(pruned)}; {self.bytes_to_string(sum(one['total_size'] for one in pruned))}; ",
+            'node_class': '',
+            'node_name': '',
+            'file_name': '',
+            'extension': '',
+            'size': sum(one['total_size'] for one in pruned),
+            'categories': '',
+            'node_disabled': False,
+            'node_disconnected': False,
+            'path': '',
+            'file_hash': '',
+            'hash_tier': '',
+            'hash_algorithm': '',
+            'file_number': sum(len(one['all_files']) for one in pruned),
+            'hash_for_all': '',
+            'merkle_root': '',
+            'place_source': '',
+            'place_target': '',
+            'timestamp': self.anatomy['timestamp']
+        }
+        report.append(item)
+
+        if self.object_store is not None:
+            store = self.object_store
+            item = {
+                'type': 'object_store',
+                'info': f"stored:{store.stored}; linked:{store.linked}; saved:{self.bytes_to_string(store.saved_bytes)}; ",
+                'node_class': '',
+                'node_name': '',
+                'file_name': '',
+                'extension': '',
+                'size': store.saved_bytes,
+                'categories': '',
+                'node_disabled': False,
+                'node_disconnected': False,
+                'path': store.directory,
+                'file_hash': '',
+                'hash_tier': '',
+                'hash_algorithm': self.hash_algorithm,
+                'file_number': store.stored,
+                'hash_for_all': '',
+                'merkle_root': '',
+                'place_source': '',
+                'place_target': '',
+                'timestamp': self.anatomy['timestamp']
+            }
+            report.append(item)
+
+        if self.is_copy_and_hash():
+            item = {
+                'type': 'hash_verify',
+                'info': f"verified:{self.hash_verify['verified']}; mismatched:{self.hash_verify['mismatched']}; ",
+                'node_class': '',
+                'node_name': '',
+                'file_name': '',
+                'extension': '',
+                'size': 0,
+                'categories': '',
+                'node_disabled': False,
+                'node_disconnected': False,
+                'path': '',
+                'file_hash': '',
+                'hash_tier': '',
+                'hash_algorithm': '',
+                'file_number': 0,
+                'hash_for_all': '',
+                'merkle_root': '',
+                'place_source': '',
+                'place_target': '',
+                'timestamp': self.anatomy['timestamp']
+            }
+            report.append(item)
+
+        if self.hash_cache is not None:
+            item = {
+                'type': 'hash_cache',
+                'info': f"hits:{self.hash_cache.hits}; misses:{self.hash_cache.misses}; ",
+                'node_class': '',
+                'node_name': '',
+                'file_name': '',
+                'extension': '',
+                'size': 0,
+                'categories': '',
+                'node_disabled': False,
+                'node_disconnected': False,
+                'path': self.hash_cache.db_path,
+                'file_hash': '',
+                'hash_tier': '',
+                'hash_algorithm': '',
+                'file_number': 0,
+                'hash_for_all': '',
+                'merkle_root': '',
+                'place_source': '',
+                'place_target': '',
+                'timestamp': self.anatomy['timestamp']
+            }
+            report.append(item)
+
         self.report = report
 
         # Write the report to _pack_nuke folder as csv
@@ -791,6 +2811,40 @@ class PackNukeScript:
             dict_writer.writeheader()
             dict_writer.writerows(report)
 
+    def make_manifest(self):
+        """
+        Saves the package manifest with per file hashes and merkle tree of every copied media item,
+        so the ingest can find the changed files of two versions of the same sequence.
+        """
+
+        manifest = {
+            'row_id': self.row_id,
+            'script_path': self.anatomy['script_path'],
+            'timestamp': self.anatomy['timestamp'],
+            'hash_algorithm': self.hash_algorithm,
+            'media': []
+        }
+        for one in self.media_items:
+            if one['duplicate_of'] is None and one['hash_for_all'] and len(one['all_files']):
+                # files, frames and hashes in merkle leaf order, merkle_diff indexes point here
+                leaves = list(one['all_files'].leaves())
+                tree = merkle_tree(sequence.get_digest(i) for view, frame, sequence, i in leaves)
+                manifest['media'].append({
+                    'node_name': one['node_name'],
+                    'path': one['found_path'],
+                    'categories': one['categories'],
+                    'files': [sequence.name(i) for view, frame, sequence, i in leaves],
+                    'frames': [[view, frame] for view, frame, sequence, i in leaves],
+                    'hashes': [sequence.get_hash(i) for view, frame, sequence, i in leaves],
+                    'hash_for_all': one['hash_for_all'],
+                    'merkle_root': tree[-1][0],
+                    'merkle_tree': tree
+                })
+
+        pth = self.settings['job']['path'] + '/_pack_nuke/' + self.row_id + '_manifest.json'
+        with open(pth, 'w') as output_file:
+            json.dump(manifest, output_file, indent=1)
+
     def media_items_to_categories(self):
 
         def is_media_item_matching(media_item, paths, filter_options, filter_list):
@@ -862,8 +2916,12 @@ class PackNukeScript:
                 # should skip disabled
                 # print("Media Item {} skipped: disabled".format(media_item['node_name']))
                 return False, None
+            if filter_options.get('skip_unreachable', False) and not media_item['node_reachable']:
+                # does not feed any output node
+                media_item['pruned'] = True
+                return False, None
             if media_item['all_files'] and len(media_item['all_files']) > 0:
-                full_path = media_item['all_files'][0]['path']
+                full_path = media_item['all_files'].path(0)
                 _dir, file_name = os.path.split(full_path)
             else:
                 # print("Media Item {} skipped: no file found".format(media_item['node_name']))
@@ -933,35 +2991,103 @@ class PackNukeScript:
                     pass
                     # print("Media Item from node {} doesn't match the category name {}".format(media_item['node_name'], category_name))
 
+    @staticmethod
+    def mark_duplicates(items, key):
+        """
+        Marks every item as duplicate of the first item with the same key, in one pass
+        """
+        first_items = {}
+        for item in items:
+            first_item = first_items.setdefault(key(item), item)
+            if first_item is not item:
+                item['duplicate_of'] = first_item
+
+    def find_content_duplicities(self, items, key=None):
+        """
+        Marks items with the same file content as duplicates of the first one.
+        Files are grouped by size first, only files sharing a size are hashed, if not hashed yet.
+        Content is always hashed in full, also without hashes_generate, items that cannot be read are not merged.
+        """
+        if key is None:
+            key = lambda item: (item['size'], item['file_hash'])
+        unique_items = [item for item in items if item['duplicate_of'] is None and item['path']]
+        sizes = {}
+        for item in unique_items:
+            sizes[item['size']] = sizes.get(item['size'], 0) + 1
+        candidates = [item for item in unique_items if sizes[item['size']] > 1]
+
+        def hash_file(path):
+            try:
+                return self.hash_file(path)
+            except OSError as e:
+                log.warning(f"Cannot read {path} to compare content: {e}")
+                return None
+
+        unhashed = [item['path'] for item in candidates
+                    if item.get('hash_tier') != 'full' or item['file_hash'] is None]
+        if unhashed:
+            hashes = dict(zip(unhashed, self.map_files(hash_file, unhashed)))
+            for item in candidates:
+                if hashes.get(item['path']) is not None:
+                    item['file_hash'] = hashes[item['path']]
+                    item['hash_tier'] = 'full'
+        self.mark_duplicates([item for item in candidates
+                              if item.get('hash_tier') == 'full' and item['file_hash'] is not None], key)
+
     def find_media_duplicities(self):
+        """
+        Runs after media_items_to_categories, so the copied item of a group is one that has categories.
+        It gets the categories and tokens of the whole group, no category of a duplicate is lost.
+        """
+        # same directories, file names, frames and sizes
+        self.merge_media_items(lambda item: item['all_files'].identity(), merge_frames=False)
+
+        # frame subsets of the same sequence, the copied item gets the union of frames,
+        # the others are relinked to it and keep their own frame range in the Read node
+        self.merge_media_items(lambda item: item['all_files'].pattern(), merge_frames=True)
 
+    def merge_media_items(self, key, merge_frames):
+        """
+        Marks media items with the same key as duplicates of the first item that has categories.
+        Exact duplicates without categories are relinked to it too, frame subsets without categories
+        are left alone, their frames are not needed in the package.
+        """
+        groups = {}
         for media_item in self.media_items:
-            if media_item['duplicate_of'] is None:
-                for check_item in self.media_items:
-                    if check_item == media_item:
-                        continue
-                    if media_item['all_files'] == check_item['all_files']:
-                        check_item['duplicate_of'] = media_item
+            if media_item['duplicate_of'] is not None:
+                continue
+            group_key = key(media_item)
+            if group_key is not None:
+                groups.setdefault(group_key, []).append(media_item)
 
-    def find_font_duplicities(self):
+        for group in groups.values():
+            if len(group) < 2:
+                continue
+            copied = [media_item for media_item in group if media_item['categories']]
+            if not copied:
+                # nothing of the group is packed
+                continue
+            first_item = copied[0]
+            for media_item in copied if merge_frames else group:
+                if media_item is first_item:
+                    continue
+                if media_item['categories']:
+                    for category in media_item['categories']:
+                        if category not in first_item['categories']:
+                            first_item['categories'].append(category)
+                    first_item['tokens'] = {**media_item['tokens'], **first_item['tokens']}
+                media_item['duplicate_of'] = first_item
+                if merge_frames:
+                    first_item['all_files'].merge(media_item['all_files'])
+                    first_item['total_size'] = first_item['all_files'].total_size
+                    first_item['merged_items'] += 1
+                    log.info(f"{media_item['node_name']} frames merged into {first_item['node_name']}")
 
-        for font_item in self.font_items:
-            if font_item['duplicate_of'] is None:
-                for check_item in self.font_items:
-                    if check_item == font_item:
-                        continue
-                    if font_item['path'] == check_item['path']:
-                        check_item['duplicate_of'] = font_item
+    def find_font_duplicities(self):
+        self.mark_duplicates(self.font_items, lambda item: item['path'])
 
     def find_gizmo_duplicities(self):
-
-        for gizmo_item in self.gizmo_items:
-            if gizmo_item.get('duplicate_of') is None:
-                for check_item in self.gizmo_items:
-                    if check_item == gizmo_item:
-                        continue
-                    if gizmo_item['path'] == check_item['path']:
-                        check_item['duplicate_of'] = gizmo_item
+        self.mark_duplicates(self.gizmo_items, lambda item: item['path'])
 
     def media_items_to_paths(self):
         """
@@ -996,10 +3122,6 @@ class PackNukeScript:
             if len(_) > 1:
                  clean_name += _[-1]
 
-            all_file_names = []
-            for one_file in media_item['all_files']:
-                all_file_names.append(one_file['path'].split('/')[-1])
-
             if cats is not None:
                 for one_category in cats:
                     all_tokens['category'] = one_category
@@ -1013,20 +3135,12 @@ class PackNukeScript:
                     t_f = cat_set['path']['top_folder'].format(**all_tokens).replace("\\", "/")
                     t_f_r = cat_set['path']['top_folder_relink'].format(**all_tokens).replace("\\", "/")
 
-                    targets = []
-                    relinks = []
-                    for one_file in all_file_names:
-                        target = r_t + '/' + t_f + '/' + one_file
-                        targets.append(target)
-                        relinks.append(r_t_r + '/' + t_f_r + '/' + one_file)
-
+                    # per file target is template + '/' + file name, not stored for every frame
                     media_item['category_files'][one_category] = {
                         'template': r_t + '/' + t_f,
                         'template_relink': r_t_r + '/' + t_f_r,
-                        'target': targets,
                         'target_nuke': r_t + '/' + t_f + '/' + nuke_filter,
                         'target_exists': False,
-                        'relink': relinks,
                         'relink_nuke': r_t_r + '/' + t_f_r + '/' + nuke_filter
                     }
 
@@ -1039,6 +3153,10 @@ class PackNukeScript:
 
         _stngs = self.settings['fonts']
         for font_item in self.font_items:
+            if font_item['duplicate_of'] is not None:
+                # duplicates share the packaged font of the first item, it comes earlier in the list
+                font_item['font_files'] = font_item['duplicate_of']['font_files']
+                continue
             tokens = {
                 'node': font_item['node_name'],
                 'class': font_item['node_class'],
@@ -1120,6 +3238,10 @@ class PackNukeScript:
 
         _stngs = self.settings['gizmos']
         for item in self.gizmo_items:
+            if item['duplicate_of'] is not None:
+                # duplicates share the packaged gizmo of the first item, it comes earlier in the list
+                item['gizmo_files'] = item['duplicate_of']['gizmo_files']
+                continue
             tokens = {
                 'node': item['node_name'],
                 'class': item['node_class'],
@@ -1196,28 +3318,154 @@ class PackNukeScript:
         shutil.copy2(source, target)
         return 0
 
+    def copy_file_and_hash(self, source, targets, known_hash=None):
+        """
+        Copies source file to one or more targets and hashes the bytes on the way,
+        so the source is read only once.
+        With object store, the file is stored once per package and targets are linked to it.
+        :param source: source file path
+        :param targets: list of target file paths
+        :param known_hash: previously known hash to verify against, hash cache is used if None
+        :return: hash of the copied file, True/False for verified/mismatched or None if nothing to verify
+        """
+
+        if self.object_store is not None:
+            return self.store_file_and_hash(source, targets, known_hash)
+        return self.write_file_and_hash(source, targets, known_hash)
+
+    def store_file_and_hash(self, source, targets, known_hash=None):
+        """
+        Links targets to the object of the source file, writes the object first if no task did yet.
+        Known hash names the object before reading, otherwise the file is hashed into a temporary object.
+        """
+
+        store = self.object_store
+        size = self.dir_cache.getsize(source)
+        if known_hash is None and self.hash_cache is not None:
+            known_hash = self.hash_cache.get(source, self.dir_cache.cache_stat(source))
+
+        if known_hash is not None:
+            object_path = store.object_path(known_hash)
+            if not os.path.isfile(object_path):
+                if store.claim(object_path):
+                    try:
+                        if not os.path.isfile(object_path):
+                            temp_path = store.temp_path()
+                            my_hash, verified = self.write_file_and_hash(source, [temp_path], known_hash)
+                            object_path = store.publish(temp_path, my_hash, size)
+                            store.link(object_path, targets, size)
+                            return my_hash, verified
+                    finally:
+                        store.release(store.object_path(known_hash))
+                elif not store.wait(object_path):
+                    # the other task did not finish in time, copy without the store
+                    log.warning(f"Object {object_path} not written in time, copying {source}")
+                    return self.write_file_and_hash(source, targets, known_hash)
+            store.link(object_path, targets, size)
+            return known_hash, None
+
+        temp_path = store.temp_path()
+        my_hash, verified = self.write_file_and_hash(source, [temp_path], known_hash)
+        object_path = store.object_path(my_hash)
+        if os.path.isfile(object_path):
+            os.remove(temp_path)
+        else:
+            object_path = store.publish(temp_path, my_hash, size)
+        store.link(object_path, targets, size)
+        return my_hash, verified
+
+    def write_file_and_hash(self, source, targets, known_hash=None):
+        """
+        Writes source file to all targets in one read, see copy_file_and_hash()
+        """
+
+        # only the hash cache needs the stat
+        stat = self.dir_cache.cache_stat(source) if self.hash_cache is not None else None
+        verify = self.settings['hashes'].get('copy_and_hash_verify', False)
+        if verify and known_hash is None and self.hash_cache is not None:
+            known_hash = self.hash_cache.get(source, stat)
+
+        hasher = HASH_ALGORITHMS[self.hash_algorithm]()
+        buffer = bytearray(HASH_CHUNK_SIZE)
+        view = memoryview(buffer)
+        with open(source, 'rb', buffering=0) as one_file, contextlib.ExitStack() as stack:
+            target_files = [stack.enter_context(open(target, 'wb')) for target in targets]
+            while True:
+                read = one_file.readinto(buffer)
+                if not read:
+                    break
+                hasher.update(view[:read])
+                for target_file in target_files:
+                    target_file.write(view[:read])
+        for target in targets:
+            shutil.copystat(source, target)
+        my_hash = hasher.hexdigest()
+
+        if self.hash_cache is not None:
+            self.hash_cache.set(source, stat, my_hash)
+
+        verified = None
+        if verify and known_hash is not None:
+            verified = known_hash == my_hash
+            if not verified:
+                log.error(f"Hash mismatch for {source}: expected {known_hash}, copied {my_hash}")
+        return my_hash, verified
+
+    def count_verified(self, verified):
+        if verified is True:
+            self.hash_verify['verified'] += 1
+        elif verified is False:
+            self.hash_verify['mismatched'] += 1
+
+    def copy_media_item_and_hash(self, media_item):
+        """
+        Copies all files of media item to every category target in one read, fills the hashes
+        """
+
+        if not media_item['category_files']:
+            return
+        for paths in media_item['category_files'].values():
+            os.makedirs(paths['template'], exist_ok=True)
+
+        file_set = media_item['all_files']
+
+        def copy_one(i):
+            name = file_set.name(i)
+            targets = [paths['template'] + '/' + name for paths in media_item['category_files'].values()]
+            # fast and stat tiers are no content hashes to verify against
+            known_hash = file_set.get_hash(i) if file_set.get_tier(i) == 'full' else None
+            return self.copy_file_and_hash(file_set.path(i), targets, known_hash=known_hash)
+
+        file_count = len(file_set)
+        threads = int(self.settings['hashes'].get('hashes_threads', 1) or 1)
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, min(threads, file_count))) as executor:
+            results = list(executor.map(copy_one, range(file_count)))
+
+        for i, (my_hash, verified) in enumerate(results):
+            file_set.set_hash(i, my_hash, 'full')
+            self.count_verified(verified)
+        media_item['hash_for_all'] = self.hash_for_all(file_set.hashes())
+
     def copy_media(self):
         start = timeit.timeit()
 
         for media_item in self.media_items:
             if media_item['duplicate_of'] is None:
-                source_folder = '/'.join(media_item['found_path_filter'].split('/')[:-1])
-                file_name_filter = None
-                if '?' in media_item['found_path_filter']:
-                    file_name_filter = media_item['found_path_filter'].split('/')[-1]
+                if self.is_copy_and_hash():
+                    self.copy_media_item_and_hash(media_item)
+                    continue
                 for one_category, paths in media_item['category_files'].items():
                     # make sure the target folder exists
-                    destination_folder = '/'.join(paths['target'][0].split('/')[0:-1])
+                    destination_folder = paths['template']
                     os.makedirs(destination_folder, exist_ok=True)
-                    if file_name_filter:
-                        return_code, output, error = self.copy_sequence(source_folder, destination_folder,
-                                                                        file_name_filter)
-                    else:
-                        # might not be file sequence, will loop all files anyway, just in case
-                        for i in range(0, len(media_item['all_files'])):
-                            source = media_item['all_files'][i]['path']
-                            target = paths['target'][i]
-                            self.copy_file(source, target)
+                    # one sequence per view, trimmed sequences file by file
+                    for sequence in media_item['all_files'].sequences:
+                        if sequence.padding and not sequence.trimmed:
+                            return_code, output, error = self.copy_sequence(sequence.directory, destination_folder,
+                                                                            sequence.glob_filter())
+                        else:
+                            for i in range(len(sequence)):
+                                self.copy_file(sequence.path(i), destination_folder + '/' + sequence.name(i))
 
         end = timeit.timeit()
         print("Coping media took {} seconds".format(int(end - start)))
@@ -1228,7 +3476,14 @@ class PackNukeScript:
         for item in self.font_items:
             if item['duplicate_of'] is None:
                 os.makedirs(os.path.dirname(item['font_files']['target']), exist_ok=True)
-                self.copy_file(item['path'], item['font_files']['target'])
+                if self.is_copy_and_hash():
+                    known_hash = item['file_hash'] if item.get('hash_tier') == 'full' else None
+                    item['file_hash'], verified = self.copy_file_and_hash(item['path'], [item['font_files']['target']],
+                                                                          known_hash=known_hash)
+                    item['hash_tier'] = 'full'
+                    self.count_verified(verified)
+                else:
+                    self.copy_file(item['path'], item['font_files']['target'])
 
         end = timeit.timeit()
         print("Coping fonts took {} seconds".format(int(end - start)))
@@ -1239,7 +3494,14 @@ class PackNukeScript:
         for item in self.gizmo_items:
             if item['duplicate_of'] is None:
                 os.makedirs(os.path.dirname(item['gizmo_files']['target']), exist_ok=True)
-                self.copy_file(item['path'], item['gizmo_files']['target'])
+                if self.is_copy_and_hash():
+                    known_hash = item['file_hash'] if item.get('hash_tier') == 'full' else None
+                    item['file_hash'], verified = self.copy_file_and_hash(item['path'], [item['gizmo_files']['target']],
+                                                                          known_hash=known_hash)
+                    item['hash_tier'] = 'full'
+                    self.count_verified(verified)
+                else:
+                    self.copy_file(item['path'], item['gizmo_files']['target'])
 
         end = timeit.timeit()
         print("Coping gizmos took {} seconds".format(int(end - start)))
@@ -1250,9 +3512,24 @@ class PackNukeScript:
         ocio_files = self.ocio.get('files')
         if ocio_files is None:
             return
+        ocio_hashes = {}
+        known_hashes = {one_file['path']: one_file['hash'] for one_file in self.ocio.get('all_files') or []
+                        if one_file.get('hash_tier') == 'full'}
         for item in self.ocio['files']:
             os.makedirs(os.path.dirname(item['target']), exist_ok=True)
-            self.copy_file(item['path'], item['target'])
+            if self.is_copy_and_hash():
+                ocio_hashes[item['path']], verified = self.copy_file_and_hash(item['path'], [item['target']],
+                                                                              known_hash=known_hashes.get(item['path']))
+                self.count_verified(verified)
+            else:
+                self.copy_file(item['path'], item['target'])
+        if ocio_hashes:
+            for one_file in self.ocio['all_files']:
+                if one_file['path'] in ocio_hashes:
+                    one_file['hash'] = ocio_hashes[one_file['path']]
+                    one_file['hash_tier'] = 'full'
+            if all(one_file['hash'] is not None for one_file in self.ocio['all_files']):
+                self.ocio['hash_for_all'] = self.hash_for_all(one_file['hash'] for one_file in self.ocio['all_files'])
 
         end = timeit.timeit()
         print("Coping ocio took {} seconds".format(int(end - start)))
@@ -1266,14 +3543,11 @@ class PackNukeScript:
 
         for one in self.gizmo_items:
             gizmo = one['node']
+            gizmo_full_name = one['node_name']
 
-            inputs = []
-            for x in range(0, gizmo.maximumInputs()):
-                if gizmo.input(x):
-                    # print 'input: %s' % (gizmo.input(x).knob('name').value())
-                    inputs.append(gizmo.input(x))
-                else:
-                    inputs.append(False)
+            # connections from the node graph, earlier converted gizmos are already swapped in
+            inputs = [x if x is not None else False for x in self.node_graph.input_nodes(gizmo_full_name)]
+            outputs = self.node_graph.output_nodes(gizmo_full_name)
             orig_name = gizmo.knob('name').value()
             orig_pos_x = gizmo.xpos()
             orig_pos_y = gizmo.ypos()
@@ -1290,8 +3564,12 @@ class PackNukeScript:
             # disconnect old inputs, reconnect inputs
             for x in range(0, new_group.maximumInputs()):
                 new_group.setInput(x, None)
-                if inputs[x]:
+                if x < len(inputs) and inputs[x]:
                     new_group.connectInput(x, inputs[x])
+            # reconnect nodes below the gizmo
+            for dependent, x in outputs:
+                dependent.setInput(x, new_group)
+            self.node_graph.replace(gizmo_full_name, new_group)
 
     def make_relative(self, my_path, my_root, up_allowed=True):
 
@@ -1473,15 +3751,26 @@ class PackNukeScript:
         log.info("Read Comp Data started.")
         self.read_comp_data()
 
-        # find duplicities
+        # filter categories
+        log.info("Filter categories")
+        self.media_items_to_categories()
+
+        # find duplicities, media after categories, the copied item must be one that is packed
         log.info("Find duplicities.")
         self.find_media_duplicities()
         self.find_font_duplicities()
         self.find_gizmo_duplicities()
 
-        # filter categories
-        log.info("Filter categories")
-        self.media_items_to_categories()
+        # hash only what is going to be copied
+        log.info("Hash files")
+        self.hash_items()
+
+        # the same fonts and gizmos installed in several folders
+        log.info("Find duplicities by content.")
+        self.find_content_duplicities(self.font_items)
+        # gizmo class comes from the file name, only gizmos of the same name can share a file
+        self.find_content_duplicities(self.gizmo_items, key=lambda item: (
+            os.path.basename(item['path']), item['size'], item['file_hash']))
 
         # generate target paths and relink paths
         log.info("Generate paths")
@@ -1490,7 +3779,8 @@ class PackNukeScript:
         self.gizmo_items_to_paths()
         self.ocio_to_paths()
 
-    def process_script(self):
+    def copy_files(self):
+        """Copies everything prepare_script() found, no Nuke needed"""
 
         log.info("Copy media")
         self.copy_media()
@@ -1498,15 +3788,88 @@ class PackNukeScript:
         self.copy_fonts()
         log.info("Copy gizmos")
         self.copy_gizmos()
+        log.info("Copy OCIO")
+        self.copy_ocio()
+
+    def relink_script(self):
+        """Converts gizmos and saves the relinked Nuke scripts, the only step that needs Nuke"""
+
+        if not self.script_open:
+            log.info("Open Nuke script")
+            self.open_script()
+        if self.node_graph is None:
+            self.node_graph = NodeGraph(nuke.allNodes(recurseGroups=True))
+
         if self.settings['gizmos']['to_groups']:
             log.info("Gizmos to groups")
             self.gizmos_to_groups()
-        log.info("Copy OCIO")
-        self.copy_ocio()
         log.info("Make Nuke scripts")
         self.make_nuke_scripts()
+
+    def write_report(self):
+
         log.info("Make Report")
         self.make_report()
+        self.make_manifest()
+        if self.hash_cache is not None:
+            self.hash_cache.close()
+        if self.object_store is not None:
+            self.object_store.close()
+
+    def process_script(self):
+
+        self.copy_files()
+        self.relink_script()
+        self.write_report()
+
+    def discovery_path(self) -> str:
+        return self.settings['job']['path'] + '/_pack_nuke/' + self.row_id + '_discovery.pickle'
+
+    def save_discovery(self):
+        """
+        Saves the prepared items of a plain Python run for the Nuke relink step (--relink).
+        Nodes are saved by full name, relink_script() looks them up in the opened script.
+        """
+
+        class Pickler(pickle.Pickler):
+            def persistent_id(self, obj):
+                if isinstance(obj, NkNode) or (nuke is not None and isinstance(obj, nuke.Node)):
+                    return obj.fullName()
+                return None
+
+        state = {
+            'ocio': self.ocio,
+            'media_items': self.media_items,
+            'font_items': self.font_items,
+            'gizmo_items': self.gizmo_items,
+            'categories': self.categories
+        }
+        with open(self.discovery_path(), 'wb') as output_file:
+            Pickler(output_file).dump(state)
+
+    def load_discovery(self) -> bool:
+        """
+        Loads items saved by save_discovery(), False if there are none
+        """
+
+        script_open = self.script_open
+
+        class Unpickler(pickle.Unpickler):
+            def persistent_load(self, pid):
+                # headless read script is opened later, open_script() binds the nodes then
+                return nuke.toNode(pid) if script_open else None
+
+        try:
+            with open(self.discovery_path(), 'rb') as input_file:
+                state = Unpickler(input_file).load()
+        except FileNotFoundError:
+            return False
+        self.ocio = state['ocio']
+        self.media_items = state['media_items']
+        self.font_items = state['font_items']
+        self.gizmo_items = state['gizmo_items']
+        self.categories = state['categories']
+        return True
 
 
 if __name__ == "__main__":
@@ -1521,9 +3884,15 @@ if __name__ == "__main__":
     pack_nuke_gui submits to Deadline:
         - each Nuke script to be packed as a separate task,
         running this python script via Nuke -t argument 
+
+    without Nuke, plain python runs the headless discovery, hashing, copying and report:
+        python pack_nuke.py nuke_script settings row_id
+    and saves the found items, relinked scripts are then written by a separate Nuke task:
+        Nuke -t pack_nuke.py --relink nuke_script settings row_id
     
     arguments:
         this_script: path to this script
+        --relink: only convert gizmos and save the Nuke scripts, items come from the plain python run
         nuke_script: path to .nk Nuke file
         settings: path to .json settings file
         row_id: the id of the render job, used to identify the line in csv file
@@ -1593,10 +3962,22 @@ if __name__ == "__main__":
     log.setLevel(logging.DEBUG)
     log.info('Started at: ' + time.strftime("%Y-%m-%d, %H:%M"))
 
-    # arguments
-    nuke_file = nuke.rawArgs[-3]
-    settings_file = nuke.rawArgs[-2]
-    row_id = nuke.rawArgs[-1]
+    # hash benchmark: pack_nuke.py --benchmark [file to hash]
+    if '--benchmark' in sys.argv:
+        benchmark_args = sys.argv[sys.argv.index('--benchmark') + 1:]
+        benchmark_path = benchmark_args[0] if benchmark_args else None
+        for algorithm, speed in benchmark_hash_algorithms(path=benchmark_path).items():
+            print(f"{algorithm}: {speed:.1f} MB/s")
+        sys.exit(0)
+
+    # arguments, sys.argv when run in plain python
+    args = nuke.rawArgs if nuke is not None else sys.argv
+    if len(args) < 4:
+        sys.exit("Usage: pack_nuke.py [--relink] nuke_script settings row_id")
+    relink = '--relink' in args
+    nuke_file = args[-3]
+    settings_file = args[-2]
+    row_id = args[-1]
 
     # settings json file
     settings_dict = load_settings(settings_file)
@@ -1618,9 +3999,30 @@ if __name__ == "__main__":
         sys.exit("Failed to read anatomy.")
 
     if anatomy != {} and settings_dict != {}:
-        pack = PackNukeScript(nuke_file, anatomy, settings_dict, row_id, csv_row.get('Source'), csv_row.get('Target'))
-        pack.prepare_script()
-        pack.process_script()
+        if nuke is None:
+            # no Nuke to fall back to, scripts that need it fail in PackNukeScript
+            settings_dict.setdefault('discovery', {})['headless'] = True
+        try:
+            pack = PackNukeScript(nuke_file, anatomy, settings_dict, row_id, csv_row.get('Source'),
+                                  csv_row.get('Target'))
+        except RuntimeError as e:
+            log.critical(f"{e}, run the task with Nuke -t.")
+            sys.exit(f"Failed to read {nuke_file} without Nuke.")
+        if nuke is None:
+            pack.prepare_script()
+            pack.copy_files()
+            pack.write_report()
+            pack.save_discovery()
+            log.info(f"Relinked scripts need Nuke: Nuke -t {__file__} --relink {nuke_file} {settings_file} {row_id}")
+        elif relink and pack.load_discovery():
+            pack.relink_script()
+            if pack.hash_cache is not None:
+                pack.hash_cache.close()
+        else:
+            if relink:
+                log.warning(f"No saved discovery {pack.discovery_path()}, packing the whole script in Nuke.")
+            pack.prepare_script()
+            pack.process_script()
     else:
         log.error(f"Error packing {row_id}.")
 
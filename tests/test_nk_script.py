@@ -0,0 +1,141 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pack_nuke  # noqa: E402
+
+NK_SCRIPT = """#! nuke -nx
+version 14.0 v5
+define_window_layout_xml {<?xml version="1.0" encoding="UTF-8"?>
+<layout version="1.0"/>
+}
+Root {
+ inputs 0
+ name /jobs/show/comp.nk
+ project_directory "\\[python \\{nuke.script_directory()\\}]"
+ first_frame 1001
+ last_frame 1100
+ views {{left #ff0000}
+   {right #00ff00}}
+}
+Read {
+ inputs 0
+ file /plates/sh010.%04d.exr
+ first 1001
+ last 1100
+ name Read1
+ xpos 0
+ ypos 0
+}
+TimeClip {
+ first 1001
+ last 1050
+ name TimeClip1
+}
+Text {
+ font /fonts/Arial.ttf
+ message "shot sh010"
+ name Text1
+}
+Read {
+ inputs 0
+ file /plates/bg.mov
+ name Read2
+}
+Group {
+ name Group1
+}
+ Input {
+  inputs 0
+  name Input1
+ }
+ Blur {
+  size 4
+  name Blur1
+ }
+ Output {
+  name Output1
+ }
+end_group
+Merge2 {
+ inputs 2
+ name Merge1
+}
+AddTimeCode {
+ startcode 01:00:00:00
+ name AddTimeCode1
+}
+ContactSheet {
+ name ContactSheet1
+}
+Write {
+ file /out/sh010.%04d.exr
+ use_limit true
+ first 1001
+ last 1050
+ name Write1
+}
+"""
+
+
+def write_script(tmp_path, text):
+    path = tmp_path / 'comp.nk'
+    path.write_text(text)
+    return str(path)
+
+
+def test_parse_representative_script(tmp_path):
+    script = pack_nuke.NkScript.parse(write_script(tmp_path, NK_SCRIPT))
+    script.mark_gizmos([], os.path.isfile)
+
+    assert script.fallback_reasons == []
+    nodes = {node.fullName(): node for node in script.nodes}
+    assert list(nodes) == ['Read1', 'TimeClip1', 'Text1', 'Read2', 'Group1', 'Group1.Input1', 'Group1.Blur1',
+                           'Group1.Output1', 'Merge1', 'AddTimeCode1', 'ContactSheet1', 'Write1']
+    assert nodes['Text1'].knob('font').Class() == 'File_Knob'
+    assert nodes['Read1'].knob('file').Class() == 'File_Knob'
+    assert nodes['Write1'].knob('first').value() == 1001
+    assert not any(node.gizmo for node in script.nodes)
+    assert script.project_directory == str(tmp_path).replace('\\', '/')
+
+    root_context = pack_nuke.RootContext.from_nk(script)
+    assert root_context.views == ('left', 'right')
+    assert (root_context.first_frame, root_context.last_frame) == (1001, 1100)
+
+
+def test_parse_connections(tmp_path):
+    script = pack_nuke.NkScript.parse(write_script(tmp_path, NK_SCRIPT))
+    nodes = {node.fullName(): node for node in script.nodes}
+
+    def names(node):
+        return [one.fullName() if one is not None else None for one in node.connected]
+
+    assert names(nodes['TimeClip1']) == ['Read1']
+    assert names(nodes['Text1']) == ['TimeClip1']
+    assert names(nodes['Group1']) == ['Read2']
+    assert names(nodes['Group1.Blur1']) == ['Group1.Input1']
+    assert names(nodes['Merge1']) == ['Group1', 'Text1']
+    assert names(nodes['Write1']) == ['ContactSheet1']
+
+
+def test_expression_knobs_fall_back(tmp_path):
+    text = NK_SCRIPT.replace(' first 1001\n last 1100\n name Read1', ' first {{1001+0}}\n last 1100\n name Read1')
+    text = text.replace(' size 4\n', ' size 4\n disable {{parent.disable}}\n')
+    script = pack_nuke.NkScript.parse(write_script(tmp_path, text))
+
+    assert script.fallback_reasons == ['Read1.first needs expression: {1001+0}',
+                                       'Group1.Blur1.disable needs expression: {parent.disable}']
+
+
+def test_unknown_class_falls_back(tmp_path):
+    text = NK_SCRIPT.replace('ContactSheet {', 'StudioGrain {')
+    script = pack_nuke.NkScript.parse(write_script(tmp_path, text))
+    script.mark_gizmos([str(tmp_path)], os.path.isfile)
+    assert script.fallback_reasons == ['ContactSheet1 class StudioGrain not found on plugin path']
+
+    (tmp_path / 'StudioGrain.gizmo').write_text('Gizmo {\n}\n')
+    script = pack_nuke.NkScript.parse(write_script(tmp_path, text))
+    script.mark_gizmos([str(tmp_path)], os.path.isfile)
+    assert script.fallback_reasons == []
+    assert [node.fullName() for node in script.nodes if node.gizmo] == ['ContactSheet1']